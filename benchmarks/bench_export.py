@@ -0,0 +1,99 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import cv2
+import numpy as np
+from src.export import IMAGE_FORMATS, ImageSink, VideoSink, imwrite_params
+
+# Run from the repository root: python -m benchmarks.bench_export
+
+def synthetic_frames(height, width, count, seed=0):
+    # Smooth color gradients with some noise, closer to flow visualizations than
+    # pure noise (which no encoder compresses).
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    frames = []
+    for t in range(count):
+        hsv = np.dstack([(x + 3 * t) % 180, np.full_like(x, 255), (y * 255 / height)]).astype(np.uint8)
+        frame = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+        frame[rng.random((height, width)) < 0.01] = 0
+        frames.append(frame)
+    return frames
+
+def serial_images(frames, directory, ext, compression):
+    # The one-imwrite-per-frame loop exports used before, kept as the reference.
+    params = imwrite_params(ext, compression)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(directory, f"frame_{i:04d}.{ext}"), frame, params)
+
+def pooled_images(frames, directory, ext, compression, workers=None):
+    sink = ImageSink(directory, ext, compression, workers)
+    for frame in frames:
+        sink.write(frame)
+    sink.close()
+
+def serial_video(frames, directory, produce_ms=0.0):
+    path = os.path.join(directory, 'out.mp4')
+    writer = None
+    for frame in frames:
+        time.sleep(produce_ms / 1e3)
+        if writer is None:
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (frame.shape[1], frame.shape[0]))
+        writer.write(frame)
+    writer.release()
+
+def queued_video(frames, directory, produce_ms=0.0):
+    sink = VideoSink(os.path.join(directory, 'out.mp4'), 30)
+    for frame in frames:
+        time.sleep(produce_ms / 1e3)
+        sink.write(frame)
+    sink.close()
+
+def time_ms(func, frames, *args):
+    # Milliseconds per frame, each run writing into a fresh directory.
+    directory = tempfile.mkdtemp(prefix='videoflow-bench-')
+    try:
+        t0 = time.perf_counter()
+        func(frames, directory, *args)
+        return (time.perf_counter() - t0) / len(frames) * 1e3
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def check_equivalence():
+    frames = synthetic_frames(48, 64, 5)
+    for ext in IMAGE_FORMATS:
+        with tempfile.TemporaryDirectory() as serial, tempfile.TemporaryDirectory() as pooled:
+            serial_images(frames, serial, ext, None)
+            pooled_images(frames, pooled, ext, None, workers=3)
+            for name in sorted(os.listdir(serial)):
+                with open(os.path.join(serial, name), 'rb') as a, open(os.path.join(pooled, name), 'rb') as b:
+                    if a.read() != b.read():
+                        raise AssertionError(f"Mismatch for {ext} frame {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs pooled image export, direct vs queued video encoding")
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--produce-ms', type=float, default=20.0, help="Simulated processing time per frame for the video cases")
+    args = parser.parse_args()
+
+    check_equivalence()
+    print("Equivalence check passed")
+
+    print(f"{cv2.getNumberOfCPUs()} CPUs")
+    print(f"{'resolution':<10} {'case':<16} {'serial ms':>10} {'parallel ms':>12} {'speedup':>8}")
+    for name, (height, width) in (("1080p", (1080, 1920)), ("4K", (2160, 3840))):
+        frames = synthetic_frames(height, width, args.frames)
+        for ext, (_, (low, high), default) in IMAGE_FORMATS.items():
+            for level in sorted({low if ext == 'png' else high, default}):
+                serial = time_ms(serial_images, frames, ext, level)
+                pooled = time_ms(pooled_images, frames, ext, level)
+                print(f"{name:<10} {f'{ext} {level}':<16} {serial:>10.1f} {pooled:>12.1f} {serial / pooled:>7.1f}x")
+        # Encoding overlapped with a producer that needs produce_ms per frame.
+        serial = time_ms(serial_video, frames, args.produce_ms)
+        queued = time_ms(queued_video, frames, args.produce_ms)
+        print(f"{name:<10} {'mp4 + producer':<16} {serial:>10.1f} {queued:>12.1f} {serial / queued:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,43 @@
+import argparse
+import time
+import cv2
+import numpy as np
+from src.processors import compute_flow, create_flow_engine, FLOW_ALGORITHMS, FLOW_MODES
+
+# Run from the repository root: python -m benchmarks.bench_flow
+
+def synthetic_pairs(count, height, width, seed=0):
+    # Smooth texture translating a couple of pixels per frame.
+    rng = np.random.default_rng(seed)
+    texture = cv2.GaussianBlur(rng.integers(0, 256, (height, width), dtype=np.uint8), (0, 0), 3)
+    return [np.roll(texture, (t, 2 * t), axis=(0, 1)) for t in range(count)]
+
+def per_pair_ms(frames, calc):
+    t0 = time.perf_counter()
+    for prev, next in zip(frames, frames[1:]):
+        calc(prev, next)
+    return (time.perf_counter() - t0) / (len(frames) - 1) * 1e3
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-pair optical flow latency")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--algorithms', nargs='+', default=list(FLOW_ALGORITHMS))
+    parser.add_argument('--mode', choices=list(FLOW_MODES), default="Full", help="Engine processing mode")
+    parser.add_argument('--scale', type=float, default=0.5, help="Downscale for the Coarse mode")
+    parser.add_argument('--tile-size', type=int, default=512)
+    args = parser.parse_args()
+
+    frames = synthetic_pairs(args.frames, args.height, args.width)
+    print(f"{'algorithm':<20} {'compute_flow':>13} {'engine':>8} {'engine+warm':>12}  (ms/pair)")
+    for algorithm in args.algorithms:
+        params = {'algorithm': algorithm, 'win_size': 15, 'pyr_levels': 3, 'iterations': 3,
+                  'flow_mode': args.mode, 'flow_scale': args.scale, 'tile_size': args.tile_size}
+        one_shot = per_pair_ms(frames, lambda a, b: compute_flow(a, b, params))
+        engine = per_pair_ms(frames, create_flow_engine(params).calc)
+        warm = per_pair_ms(frames, create_flow_engine(dict(params, warm_start=True)).calc)
+        print(f"{algorithm:<20} {one_shot:>13.2f} {engine:>8.2f} {warm:>12.2f}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
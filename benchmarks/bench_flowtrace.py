@@ -0,0 +1,88 @@
+import argparse
+import itertools
+import time
+import tracemalloc
+import numpy as np
+from src.processors import compute_flowtrace, FlowTraceEngine
+
+# Run from the repository root: python -m benchmarks.bench_flowtrace
+
+def synthetic_frames(count, height, width, seed=0):
+    # Static textured background with sensor noise and a bright blob sweeping down.
+    rng = np.random.default_rng(seed)
+    base = rng.integers(40, 200, (height, width)).astype(np.int16)
+    frames = np.empty((count, height, width), dtype=np.uint8)
+    for t in range(count):
+        frame = base + rng.integers(-4, 5, (height, width))
+        y = (t * 3) % max(1, height - 20)
+        frame[y:y + 20, width // 4:width // 4 + 40] = 250
+        np.clip(frame, 0, 255, out=frame)
+        frames[t] = frame
+    return frames
+
+def reference_flowtrace(stack, params):
+    # The original float64 formulation, timed for comparison; tests/test_flowtrace.py
+    # checks that every FlowTrace path matches it.
+    if params['invert']:
+        stack = 255 - stack
+    if params['bg_subtract']:
+        bg = np.median(stack, axis=0)
+        stack = stack - bg[None, :, :]
+        stack = np.clip(stack, 0, 255)
+    return np.max(stack, axis=0).astype(np.uint8)
+
+def peak_mb(fn):
+    # Peak of NumPy allocations while fn runs, in MB.
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+def bench_engine(frames, params):
+    # (ms per frame, peak MB including the engine's own buffers). Timed without
+    # tracemalloc, which slows down code that allocates often.
+    engine = FlowTraceEngine(frames.shape[1:], params)
+    t0 = time.perf_counter()
+    for frame in frames:
+        engine.push(frame)
+    ms = (time.perf_counter() - t0) / len(frames) * 1e3
+    def run():
+        engine = FlowTraceEngine(frames.shape[1:], params)
+        for frame in frames[:params['win_size'] + 2]:
+            engine.push(frame)
+    return ms, peak_mb(run)
+
+def bench_window(frames, length, fn, params, windows=10):
+    windows = range(length - 1, min(len(frames), length - 1 + windows))
+    t0 = time.perf_counter()
+    for t in windows:
+        fn(frames[t - length + 1:t + 1], params)
+    ms = (time.perf_counter() - t0) / len(windows) * 1e3
+    return ms, peak_mb(lambda: fn(frames[:length], params))
+
+def main():
+    parser = argparse.ArgumentParser(description="FlowTrace engine vs compute_flowtrace")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[10, 50, 200])
+    args = parser.parse_args()
+
+    frames = synthetic_frames(max(args.lengths) * 2, args.height, args.width)
+    # Each cell is "ms per frame / peak MB"; the window's uint8 frames are length * H * W bytes.
+    columns = ('engine', 'compact engine', 'compute_flowtrace', 'float64 reference')
+    print(f"{'length':>6} {'bg':>5} {'window MB':>10} " + " ".join(f"{name:>20}" for name in columns))
+    for length, bg_subtract in itertools.product(args.lengths, [False, True]):
+        params = {'win_size': length, 'invert': False, 'bg_subtract': bg_subtract}
+        cells = [
+            bench_engine(frames, params),
+            bench_engine(frames, dict(params, trace_compact=True)),
+            bench_window(frames, length, compute_flowtrace, params),
+            bench_window(frames, length, reference_flowtrace, params)
+        ]
+        window_mb = length * args.height * args.width / 2 ** 20
+        print(f"{length:>6} {str(bg_subtract):>5} {window_mb:>10.1f} " + " ".join(f"{f'{ms:.2f} / {mb:.0f}':>20}" for ms, mb in cells))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
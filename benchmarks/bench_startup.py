@@ -0,0 +1,101 @@
+import argparse
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Run from the repository root: python -m benchmarks.bench_startup
+#
+# Cold start of the GUI, timed from process launch in a fresh interpreter per
+# run: until the window is shown, until processing is available (the
+# background imports are done) and, with --video, how long loading a video
+# takes until its first frame is displayed. "eager" imports the processing
+# stack before building the window, as the GUI used to, for comparison.
+
+MODES = ('lazy', 'eager')
+
+def run_child(mode, video):
+    # Mirrors src/main.py; prints the time.time() of each milestone as JSON.
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication
+    app = QApplication(sys.argv[:1])
+    from src.ui import MainUI, STACK_MODULES
+    if mode == 'eager':
+        for module in STACK_MODULES:
+            importlib.import_module(module)
+    times = {}
+
+    class TimedUI(MainUI):
+        def video_loaded(self, *loaded):
+            super().video_loaded(*loaded)
+            times['loaded'] = time.time()
+            QTimer.singleShot(0, finish)
+
+    window = TimedUI()
+
+    def finish():
+        print(json.dumps(times))
+        sys.stdout.flush()
+        os._exit(0)  # Skips waiting for the scrubbing threads.
+
+    def ready():
+        times['ready'] = time.time()
+        if not video:
+            QTimer.singleShot(0, finish)
+            return
+        times['load'] = time.time()
+        window.load_video(video)
+
+    window.stack_ready.connect(ready)
+    window.show()
+    app.processEvents()
+    times['shown'] = time.time()
+    app.exec()
+
+def launch(command, platform=None):
+    # Milliseconds from launch to each milestone of one child run.
+    env = dict(os.environ)
+    if platform:
+        env['QT_QPA_PLATFORM'] = platform
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    t0 = time.time()
+    output = subprocess.run(command, cwd=root, env=env, capture_output=True, text=True, check=True).stdout
+    times = json.loads(output.strip().splitlines()[-1])
+    result = {'shown': times['shown'] - t0, 'ready': times['ready'] - t0}
+    if 'loaded' in times:
+        result['load'] = times['loaded'] - times['load']
+    return {name: value * 1e3 for name, value in result.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="GUI cold start: lazy vs eager imports")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--video', help="Also time loading this video")
+    parser.add_argument('--platform', help="Qt platform plugin for the runs, e.g. offscreen")
+    parser.add_argument('--run-child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_child:
+        run_child(args.run_child, args.video)
+        return
+
+    t0 = time.perf_counter()
+    for _ in range(args.repeats):
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    interpreter = (time.perf_counter() - t0) / args.repeats * 1e3
+    print(f"Interpreter alone: {interpreter:.0f} ms")
+
+    print(f"{'mode':<8} {'shown ms':>9} {'ready ms':>9} {'load ms':>8}")
+    for mode in MODES:
+        command = [sys.executable, '-m', 'benchmarks.bench_startup', '--run-child', mode]
+        if args.video:
+            command += ['--video', os.path.abspath(args.video)]
+        runs = [launch(command, args.platform) for _ in range(args.repeats)]
+        medians = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+        load = f"{medians['load']:.0f}" if 'load' in medians else "n/a"
+        print(f"{mode:<8} {medians['shown']:>9.0f} {medians['ready']:>9.0f} {load:>8}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,73 @@
+import argparse
+import time
+import cv2
+import numpy as np
+from src.utils import visualize_flow
+
+# Run from the repository root: python -m benchmarks.bench_visualize
+
+def legacy_visualize_flow(flow, shape, params):
+    # The per-pixel loop visualize_flow used before vectorization, kept as the reference.
+    mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+    hsv = np.zeros((shape[0], shape[1], 3), dtype=np.uint8)
+    hsv[..., 0] = ang * 180 / np.pi / 2
+    hsv[..., 1] = 255
+    hsv[..., 2] = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX)
+    rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+    rgb[mag < params['mag_threshold']] = 0
+    step = params['arrow_density']
+    for y in range(0, flow.shape[0], step):
+        for x in range(0, flow.shape[1], step):
+            fx, fy = flow[y, x]
+            if mag[y, x] > params['mag_threshold']:
+                cv2.arrowedLine(rgb, (x, y), (int(x + fx), int(y + fy)), (0, 255, 0), params['arrow_size'])
+    if params['smooth']:
+        rgb = cv2.GaussianBlur(rgb, (5, 5), 0)
+    return rgb
+
+def synthetic_flow(height, width, seed=0):
+    # Rotational field plus noise, so magnitudes and angles cover their full range.
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    cx, cy = width / 2, height / 2
+    flow = np.dstack([-(y - cy), x - cx]) * (12.0 / max(height, width))
+    flow += rng.normal(0, 1.5, flow.shape)
+    return flow.astype(np.float32)
+
+def check_equivalence():
+    flow = synthetic_flow(97, 131, seed=1)
+    for threshold in (0.0, 1.0, 3.5):
+        for density in (1, 4, 16):
+            for size in (1, 3):
+                params = {'mag_threshold': threshold, 'arrow_density': density, 'arrow_size': size, 'smooth': density == 4}
+                expected = legacy_visualize_flow(flow, flow.shape, params)
+                if not np.array_equal(visualize_flow(flow, flow.shape, params), expected):
+                    raise AssertionError(f"Mismatch for {params}")
+
+def time_ms(func, flow, params, repeats):
+    func(flow, flow.shape, params)
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        func(flow, flow.shape, params)
+    return (time.perf_counter() - t0) / repeats * 1e3
+
+def main():
+    parser = argparse.ArgumentParser(description="Legacy vs vectorized flow visualization")
+    parser.add_argument('--densities', type=int, nargs='+', default=[4, 16])
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    check_equivalence()
+    print("Equivalence check passed")
+
+    print(f"{'resolution':<10} {'density':>7} {'legacy ms':>10} {'vectorized ms':>14} {'speedup':>8}")
+    for name, (height, width) in (("1080p", (1080, 1920)), ("4K", (2160, 3840))):
+        flow = synthetic_flow(height, width)
+        for density in args.densities:
+            params = {'mag_threshold': 0.5, 'arrow_density': density, 'arrow_size': 1, 'smooth': False}
+            legacy = time_ms(legacy_visualize_flow, flow, params, args.repeats)
+            vectorized = time_ms(visualize_flow, flow, params, args.repeats)
+            print(f"{name:<10} {density:>7} {legacy:>10.1f} {vectorized:>14.1f} {legacy / vectorized:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
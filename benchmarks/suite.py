@@ -0,0 +1,283 @@
+import argparse
+import atexit
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from src.cli import DEFAULT_PARAMS
+from src.pipeline import iter_results
+from src.processors import compute_flow, compute_flowtrace, FlowTraceEngine, FLOW_ALGORITHMS
+from src.storage import FrameStore
+from src.utils import visualize_flow, visualize_flowtrace
+
+# Run from the repository root: python -m benchmarks.suite
+#
+# Every case runs in a fresh interpreter so peak RSS belongs to that case alone.
+# Inputs are synthetic videos written once to --video-dir and reused.
+
+RESOLUTIONS = {'480p': (640, 480), '1080p': (1920, 1080), '4K': (3840, 2160)}
+DEFAULT_FRAMES = {'480p': 60, '1080p': 20, '4K': 8}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+ALLOC_SAMPLES = 5  # frames measured under tracemalloc, after the timed run
+
+# Metric -> whether larger values are better.
+METRICS = {'fps': True, 'peak_rss_mb': False, 'alloc_kb_per_frame': False}
+
+def make_video(path, width, height, frames, seed=0):
+    # Textured background panning (2, 1) px/frame with a bright block crossing it
+    # at (7, 3) px/frame, so the flow field has known, mixed motion.
+    rng = np.random.default_rng(seed)
+    pad = 2 * frames + 8
+    texture = cv2.GaussianBlur(rng.integers(0, 256, (height + pad, width + 2 * pad, 3), dtype=np.uint8), (0, 0), 2)
+    block = (max(8, width // 10), max(8, height // 10))
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 30, (width, height))
+    for t in range(frames):
+        frame = texture[t:t + height, 2 * t:2 * t + width].copy()
+        x, y = (width // 8 + 7 * t) % (width - block[0]), (height // 8 + 3 * t) % (height - block[1])
+        frame[y:y + block[1], x:x + block[0]] = (230, 230, 230)
+        out.write(frame)
+    out.release()
+
+def synthetic_video(video_dir, resolution, frames):
+    width, height = RESOLUTIONS[resolution]
+    path = os.path.join(video_dir, f"synthetic_{resolution}_{frames}.mp4")
+    if not os.path.exists(path):
+        os.makedirs(video_dir, exist_ok=True)
+        make_video(path + '.partial.mp4', width, height, frames)
+        os.replace(path + '.partial.mp4', path)
+    return path
+
+def read_frames(path, gray=True):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if gray else frame)
+    cap.release()
+    return frames
+
+def case_names(resolutions, algorithms):
+    names = []
+    for resolution in resolutions:
+        names += [f"compute_flow/{algorithm}/{resolution}" for algorithm in algorithms]
+        names += [f"{name}/{resolution}" for name in (
+            "compute_flowtrace", "flowtrace_engine", "flowtrace_engine/compact", "visualize_flow", "visualize_flowtrace",
+            "pipeline/Farneback", "pipeline/FlowTrace")]
+    return names
+
+def setup_case(name, video_path, frames, serial=False):
+    # Returns step(), which processes one frame of the case per call. With serial,
+    # the pipeline runs without prefetch threads so each step does exactly one
+    # frame's work.
+    kind, _, detail = name.rpartition('/')[0].partition('/')
+    params = dict(DEFAULT_PARAMS, end_frame=frames - 1)
+    counter = iter(range(1 << 62))
+
+    if kind == "compute_flow":
+        grays = read_frames(video_path)
+        params['algorithm'] = detail
+        def step():
+            i = next(counter) % (len(grays) - 1)
+            compute_flow(grays[i], grays[i + 1], params)
+        return step
+    if kind in ("compute_flowtrace", "flowtrace_engine"):
+        stack = np.stack(read_frames(video_path))
+        params.update(algorithm="FlowTrace", win_size=min(15, len(stack)), bg_subtract=True, trace_compact=detail == "compact")
+        if kind == "compute_flowtrace":
+            def step():
+                i = next(counter) % (len(stack) - params['win_size'] + 1)
+                compute_flowtrace(stack[i:i + params['win_size']], params)
+            return step
+        engine = FlowTraceEngine(stack.shape[1:], params)
+        def step():
+            engine.push(stack[next(counter) % len(stack)])
+        return step
+    if kind == "visualize_flow":
+        grays = read_frames(video_path)
+        flow = compute_flow(grays[0], grays[1], params)
+        params['mag_threshold'] = 0.5
+        return lambda: visualize_flow(flow, flow.shape, params)
+    if kind == "visualize_flowtrace":
+        stack = np.stack(read_frames(video_path)[:15])
+        trace = compute_flowtrace(stack, dict(params, bg_subtract=True))
+        params['cmap'] = 'jet'
+        return lambda: visualize_flowtrace(trace, trace.shape, params)
+    if kind == "pipeline":
+        # The work FlowProcessorThread does per output, without Qt: the full
+        # pipeline plus appending visualizations to a disk-backed store.
+        params['algorithm'] = detail
+        if serial:
+            params['prefetch'] = 0
+        if detail == "FlowTrace":
+            params.update(win_size=min(15, frames // 2), bg_subtract=True)
+        store = FrameStore()
+        atexit.register(store.close)
+        state = {'results': None}
+        def step():
+            # Restarts the run when the video is exhausted.
+            while True:
+                if state['results'] is None:
+                    state['results'] = iter_results(video_path, params)
+                try:
+                    _, viz = next(state['results'])
+                except StopIteration:
+                    state['results'] = None
+                    continue
+                store.append(viz)
+                return
+        return step
+    raise ValueError(f"Unknown benchmark case {name}")
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def run_case(name, video_path, frames):
+    step = setup_case(name, video_path, frames)
+    step()  # warm-up: first-call allocations and lazy initialization
+    steps = max(1, frames - 1)
+    t0 = time.perf_counter()
+    for _ in range(steps):
+        step()
+    elapsed = time.perf_counter() - t0
+    result = {'fps': steps / elapsed, 'ms_per_frame': elapsed / steps * 1e3, 'peak_rss_mb': peak_rss_mb()}
+    # Allocations: bytes a single frame needs on top of what is already live,
+    # NumPy and OpenCV output arrays included (both allocate through NumPy).
+    # Measured on a serial run, since read-ahead threads make per-step counts
+    # depend on scheduling.
+    step = setup_case(name, video_path, frames, serial=True)
+    step()
+    tracemalloc.start()
+    extra = []
+    for _ in range(ALLOC_SAMPLES):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        step()
+        extra.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    result['alloc_kb_per_frame'] = float(np.median(extra)) / 1024
+    return result
+
+def run_isolated(name, video_path, frames):
+    # Runs one case in a child interpreter and returns its metrics.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.suite', '--run-case', name, '--video', video_path, '--frames', str(frames)],
+        cwd=root, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__
+    }
+
+def compare(results, baseline, threshold):
+    # Yields (case, metric, value, baseline value, relative change, regressed).
+    for name, metrics in results.items():
+        reference = baseline.get('results', {}).get(name)
+        if reference is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            value, base = metrics.get(metric), reference.get(metric)
+            if value is None or not base:
+                continue
+            change = (value - base) / base
+            regressed = change < -threshold if higher_is_better else change > threshold
+            yield name, metric, value, base, change, regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite with baseline comparison")
+    parser.add_argument('--resolutions', nargs='+', choices=list(RESOLUTIONS), default=list(RESOLUTIONS))
+    parser.add_argument('--algorithms', nargs='+', default=list(FLOW_ALGORITHMS))
+    parser.add_argument('--cases', nargs='+', default=['*'], help="Glob patterns selecting cases, e.g. 'pipeline/*'")
+    parser.add_argument('--frames', type=int, help="Frames per video (default: 60 / 20 / 8 for 480p / 1080p / 4K)")
+    parser.add_argument('--video-dir', default=os.path.join(tempfile.gettempdir(), 'videoflow-bench'))
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Relative change counted as a regression (default: 0.10)")
+    parser.add_argument('--output', help="Also write this run's results to a JSON file")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--video', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.video, args.frames)))
+        return 0
+
+    names = [name for name in case_names(args.resolutions, args.algorithms)
+             if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases)]
+    results = {}
+    print(f"{'case':<40} {'fps':>9} {'ms/frame':>9} {'peak RSS MB':>12} {'alloc KB/frame':>15}")
+    for name in names:
+        resolution = name.rsplit('/', 1)[1]
+        frames = args.frames or DEFAULT_FRAMES[resolution]
+        video_path = synthetic_video(args.video_dir, resolution, frames)
+        metrics = results[name] = dict(run_isolated(name, video_path, frames), frames=frames)
+        rss = f"{metrics['peak_rss_mb']:.0f}" if metrics['peak_rss_mb'] is not None else "n/a"
+        print(f"{name:<40} {metrics['fps']:>9.1f} {metrics['ms_per_frame']:>9.2f} {rss:>12} {metrics['alloc_kb_per_frame']:>15.0f}")
+
+    # The arguments are kept so a saved baseline records how it was produced.
+    run = {'machine': machine_info(), 'arguments': sys.argv[1:], 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    status = 0
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # Differences from another machine's baseline are mostly hardware, so
+        # they are shown for reference but never fail the run.
+        same_machine = baseline.get('machine') == run['machine']
+        if not same_machine:
+            print("Warning: baseline was recorded on a different machine or library versions; "
+                  "record one here with --save-baseline to check for regressions")
+        regressions = 0
+        print(f"\nAgainst {args.baseline} (threshold {args.threshold:.0%}):")
+        for name, metric, value, base, change, regressed in compare(results, baseline, args.threshold):
+            if regressed:
+                regressions += 1
+            label = 'ok' if not regressed else 'REGRESSION' if same_machine else 'slower'
+            print(f"{label:<10} {name:<40} {metric:<18} {base:>10.1f} -> {value:>10.1f} ({change:+.1%})")
+        if same_machine:
+            print(f"{regressions} regression(s)")
+            status = 1 if regressions else 0
+        else:
+            print(f"{regressions} slower metric(s), not counted as regressions on a different machine")
+    if args.save_baseline:
+        # Cases not run this time keep their previous baseline entries.
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                previous = json.load(f)
+            if previous.get('machine') == run['machine']:
+                run['results'] = dict(previous.get('results', {}), **results)
+        with open(args.baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from src.storage import FrameStore
+
+# Parameters that change the raw flow fields or traces. Everything else
+# (colormap, threshold, arrows, smoothing) only affects rendering, or (worker
+# count, compact FlowTrace memory) only how the same results are computed.
+COMPUTE_PARAMS = (
+    'algorithm', 'win_size', 'pyr_levels', 'iterations', 'warm_start', 'warm_iterations',
+    'invert', 'bg_subtract', 'start_frame', 'end_frame', 'step',
+    'flow_mode', 'flow_scale', 'tile_size', 'tile_overlap', 'roi'
+)
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'videoflow')
+
+_file_hashes = {}
+_file_hashes_lock = threading.Lock()
+
+def file_hash(path, block_size=1 << 20):
+    # Content hash of the video, memoized per (path, size, mtime) for the session.
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        if memo_key in _file_hashes:
+            return _file_hashes[memo_key]
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    with _file_hashes_lock:
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+def file_fingerprint(path, block_size=1 << 20):
+    # Cheap stand-in for file_hash: size, mtime and the first and last blocks.
+    # Reads at most two blocks however long the video, so it can run on the GUI
+    # thread.
+    stat = os.stat(path)
+    digest = hashlib.blake2b(f"{stat.st_size}:{stat.st_mtime_ns}".encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(block_size))
+        if stat.st_size > block_size:
+            f.seek(max(block_size, stat.st_size - block_size))
+            digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+def compute_params(params):
+    return {key: params.get(key) for key in COMPUTE_PARAMS}
+
+def cache_key(video_path, params, flow_dtype=np.float16):
+    payload = json.dumps({
+        'video': file_hash(video_path),
+        'params': compute_params(params),
+        'flow_dtype': np.dtype(flow_dtype).str
+    }, sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+def compact_result(result, flow_dtype=np.float16):
+    # Flow fields are stored as flow_dtype (float16 halves the size at ~1e-3
+    # relative precision), traces are already uint8.
+    return result.astype(flow_dtype) if result.dtype.kind == 'f' else result.copy()
+
+def expand_result(result):
+    # Back to what the visualizers expect.
+    return np.asarray(result, dtype=np.float32) if result.dtype.kind == 'f' else np.asarray(result)
+
+class FlowCache:
+    # On-disk cache of raw compute_flow outputs (float16) and FlowTrace traces,
+    # one FrameStore directory per key. Entries are written under a .partial name
+    # and renamed once complete, so an interrupted run never looks like a hit.
+    # When max_bytes is set, the least recently used entries are evicted. Use
+    # flow_dtype=np.float32 when re-renders must match a fresh run bit for bit.
+    def __init__(self, root=None, max_bytes=None, compress=False, flow_dtype=np.float16):
+        self.root = root or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.flow_dtype = np.dtype(flow_dtype)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, video_path, params):
+        directory = self._entry_dir(cache_key(video_path, params, self.flow_dtype))
+        if not os.path.exists(os.path.join(directory, FrameStore.INDEX_FILE)):
+            return None
+        os.utime(directory)  # Mark as recently used.
+        return FrameStore.open(directory)
+
+    def create(self, video_path, params):
+        key = cache_key(video_path, params, self.flow_dtype)
+        directory = self._entry_dir(key) + '.partial'
+        shutil.rmtree(directory, ignore_errors=True)
+        store = FrameStore(directory, compress=self.compress)
+        store.metadata = {'key': key, 'video': os.path.abspath(video_path), 'params': compute_params(params)}
+        return store
+
+    def commit(self, store):
+        store.write_index(store.metadata)
+        store.close()
+        final = self._entry_dir(store.metadata['key'])
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(store.directory, final)
+        self.evict(keep=final)
+        return FrameStore.open(final)
+
+    def discard(self, store):
+        store.close()
+        shutil.rmtree(store.directory, ignore_errors=True)
+
+    def evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        entries = []
+        for entry in os.scandir(self.root):
+            # Only committed entries have an index; anything else sharing the
+            # directory is not the cache's to delete.
+            if (entry.is_dir() and not entry.name.endswith('.partial') and entry.path != keep
+                    and os.path.exists(os.path.join(entry.path, FrameStore.INDEX_FILE))):
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
\ No newline at end of file
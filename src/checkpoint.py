@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from src.cache import COMPUTE_PARAMS, default_cache_dir, file_fingerprint
+from src.storage import FrameStore
+
+# Parameters that only change how a run is executed, not its results.
+RUNTIME_PARAMS = ('workers', 'prefetch', 'chunk_size', 'tile_workers', 'trace_compact', 'frame_index')
+
+def run_params(params):
+    return {key: value for key, value in params.items() if key not in RUNTIME_PARAMS}
+
+def display_params(params):
+    # What a re-render from cached raw results changes.
+    return {key: value for key, value in run_params(params).items() if key not in COMPUTE_PARAMS}
+
+def run_key(video_path, params):
+    # Fingerprinted rather than hashed: open() runs when Process is pressed, and
+    # hashing a multi-hour recording would hold up the window for minutes.
+    payload = json.dumps({'video': file_fingerprint(video_path), 'params': run_params(params)}, sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+class Checkpoints:
+    # Resumable result stores, one directory per (video fingerprint, parameters).
+    # The worker streams visualizations into the store and calls save() every
+    # `interval` seconds, which flushes the frames and records how many are
+    # complete; frames appended after the last save are simply recomputed. A
+    # later run with the same parameters gets the store back from open() and
+    # continues from len(store). Stores of runs that finished are removed by
+    # release(); interrupted ones are kept for max_age seconds.
+    def __init__(self, root=None, interval=30.0, max_age=7 * 24 * 3600):
+        # Next to the flow cache rather than inside it, where eviction would see
+        # the checkpoints as one more cache entry.
+        self.root = root or default_cache_dir() + '-checkpoints'
+        self.interval = interval
+        self.max_age = max_age
+        os.makedirs(self.root, exist_ok=True)
+
+    def open(self, video_path, params):
+        self.prune()
+        key = run_key(video_path, params)
+        directory = os.path.join(self.root, key)
+        if os.path.exists(os.path.join(directory, FrameStore.INDEX_FILE)):
+            try:
+                return FrameStore.open(directory)
+            except (OSError, ValueError, KeyError):
+                pass  # Unreadable checkpoint: start over.
+        shutil.rmtree(directory, ignore_errors=True)
+        store = FrameStore(directory)
+        store.metadata = {'key': key, 'video': os.path.abspath(video_path), 'complete': False}
+        return store
+
+    def save(self, store, complete=False):
+        store.metadata['complete'] = complete
+        store.write_index(store.metadata)
+
+    def release(self, store):
+        # Done with the results: finished runs are deleted, unfinished ones stay resumable.
+        store.close()
+        if store.metadata.get('complete'):
+            shutil.rmtree(store.directory, ignore_errors=True)
+
+    def discard(self, store):
+        store.close()
+        shutil.rmtree(store.directory, ignore_errors=True)
+
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
\ No newline at end of file
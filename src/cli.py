@@ -0,0 +1,250 @@
+# Headless batch processing: python -m src.cli VIDEO [VIDEO ...] -p params.json
+# Runs the same frame pipeline as the GUI without importing Qt, one job per
+# video, streaming visualizations straight to MP4, .npy or PNG/JPEG files.
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import cv2
+import numpy as np
+from src.cache import FlowCache
+from src.export import IMAGE_FORMATS, ImageSink, VideoSink, imwrite_params
+from src.pipeline import global_params, iter_outputs, iter_results, needs_global_range, output_frames, render_outputs, validate_params
+from src.profiling import Profiler, write_report
+from src.stats import FlowStatistics
+from src.storage import NpyWriter
+from src.utils import build_frame_index
+
+# Same defaults as the GUI controls.
+DEFAULT_PARAMS = {
+    'algorithm': "Farneback",
+    'win_size': 15,
+    'pyr_levels': 3,
+    'iterations': 3,
+    'mag_threshold': 0.0,
+    'cmap': "hsv",
+    'arrow_density': 16,
+    'arrow_size': 1,
+    'smooth': False,
+    'start_frame': 0,
+    'end_frame': None,
+    'step': 1,
+    'workers': 1,
+    'invert': False,
+    'bg_subtract': False,
+    'warm_start': False,
+    'trace_compact': False,
+    'flow_mode': "Full",
+    'flow_scale': 0.5,
+    'tile_size': 512,
+    'tile_overlap': 32,
+    'roi': None,
+    'normalize': "Per Frame",
+    'norm_percentile': 99.0
+}
+
+FORMATS = ('mp4', 'npy') + tuple(IMAGE_FORMATS)
+
+def output_paths(video_path, output_dir, fmt, raw, stats=False):
+    # Final output paths for a job: the visualization, plus the raw results and
+    # the per-frame statistics when requested.
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    paths = [os.path.join(output_dir, stem if fmt in IMAGE_FORMATS else f"{stem}.{fmt}")]
+    if raw:
+        paths.append(os.path.join(output_dir, f"{stem}.raw.npy"))
+    if stats:
+        paths.append(os.path.join(output_dir, f"{stem}.stats.csv"))
+    return paths
+
+def partial_path(path):
+    # Outputs are written under a temporary name and renamed once complete, so an
+    # interrupted job never leaves a file that looks finished.
+    root, ext = os.path.splitext(path)
+    return f"{root}.partial{ext}"
+
+def open_sink(path, fmt, fps, compression=None):
+    if fmt == 'mp4':
+        return VideoSink(path, fps)
+    if fmt == 'npy':
+        return NpyWriter(path)
+    return ImageSink(path, fmt, compression)
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def resolve_params(video_path, params):
+    # Fills in the per-video parts: the frame index and, when not given, the end frame.
+    params = dict(params)
+    index = build_frame_index(video_path)
+    last = index['frame_count'] - 1
+    if params.get('end_frame') is None or params['end_frame'] > last:
+        params['end_frame'] = last
+    params['frame_index'] = index
+    validate_params(params)
+    return params
+
+def run_job(video_path, params, output_dir, fmt, raw_dtype=None, cache_dir=None, write_stats=False, compression=None):
+    # Processes one video end to end; returns its profiling report.
+    profiler = Profiler()
+    params = resolve_params(video_path, params)
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+    paths = output_paths(video_path, output_dir, fmt, raw_dtype is not None, write_stats)
+    partials = [partial_path(path) for path in paths]
+    sink = open_sink(partials[0], fmt, fps, compression)
+    raw_sink = NpyWriter(partials[1]) if raw_dtype is not None else None
+    stats = FlowStatistics() if write_stats or needs_global_range(params) else None
+    try:
+        if raw_sink is None:
+            cache = FlowCache(cache_dir) if cache_dir else None
+            for _, viz in iter_results(video_path, params, cache, profiler, stats=stats):
+                with profiler.stage('write'):
+                    sink.write(viz)
+                profiler.tick()
+        else:
+            # With global normalization the raw file is written first and rendered
+            # once the statistics of the whole range are known.
+            render = not needs_global_range(params)
+            for _, result, viz in iter_outputs(video_path, params, raw_dtype, profiler, stats=stats, render=render):
+                with profiler.stage('write'):
+                    if render:
+                        sink.write(viz)
+                    raw_sink.write(result)
+                profiler.tick()
+            if not render:
+                raw_sink.close()
+                raw = np.load(partials[1], mmap_mode='r')
+                for viz in render_outputs(global_params(params, stats), raw, profiler):
+                    with profiler.stage('write'):
+                        sink.write(viz)
+                del raw
+        if write_stats:
+            stats.write_csv(partials[-1], output_frames(params))
+        # Waits for the encoder to catch up and raises anything it hit.
+        with profiler.stage('encode_flush'):
+            sink.close()
+        if raw_sink is not None:
+            raw_sink.close()
+    except BaseException:
+        sink.abort()
+        if raw_sink is not None:
+            raw_sink.abort()
+        for path in partials:
+            remove_path(path)
+        raise
+    for partial, path in zip(partials, paths):
+        remove_path(path)
+        os.replace(partial, path)
+    return profiler.report()
+
+def expand_inputs(patterns):
+    # Globs are expanded here as well, since Windows shells pass them through.
+    videos = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        videos.extend(path for path in matches if os.path.isfile(path))
+    return list(dict.fromkeys(videos))
+
+def load_params(path):
+    params = dict(DEFAULT_PARAMS)
+    if path:
+        with open(path) as f:
+            params.update(json.load(f))
+    return params
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.cli', description="Batch optical flow / FlowTrace processing without the GUI.")
+    parser.add_argument('videos', nargs='+', help="Video files or glob patterns")
+    parser.add_argument('-p', '--params', help="JSON file with processing parameters (same keys as the GUI)")
+    parser.add_argument('-o', '--output-dir', default='output', help="Directory for the results (default: output)")
+    parser.add_argument('-f', '--format', choices=FORMATS, default='mp4', help="Visualization output format (default: mp4)")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="Videos processed concurrently (default: 1)")
+    parser.add_argument('-w', '--workers', type=int, help="Worker threads per video, overrides the params file")
+    parser.add_argument('--compression', type=int, metavar='LEVEL', help="PNG compression level (0-9, default 3) or JPEG quality (0-100, default 95)")
+    parser.add_argument('--raw', action='store_true', help="Also write raw flow fields / traces as <name>.raw.npy (bypasses --cache)")
+    parser.add_argument('--raw-dtype', choices=('float16', 'float32'), default='float16', help="Storage type of raw flow fields")
+    parser.add_argument('--cache', nargs='?', const='', metavar='DIR', help="Reuse and fill the raw flow cache (default location if DIR is omitted)")
+    parser.add_argument('--profile', metavar='PATH', help="Write per-stage timings of every video to PATH (.json or .csv)")
+    parser.add_argument('--stats', action='store_true', help="Also write per-frame flow magnitude and direction statistics as <name>.stats.csv")
+    parser.add_argument('--skip-existing', action='store_true', help="Skip videos whose outputs already exist")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    params = load_params(args.params)
+    if args.workers is not None:
+        params['workers'] = args.workers
+    videos = expand_inputs(args.videos)
+    if not videos:
+        logging.error("No input videos found")
+        return 2
+    stems = [os.path.splitext(os.path.basename(video))[0] for video in videos]
+    if len(set(stems)) != len(stems):
+        logging.error("Input videos must have distinct file names (outputs are named after them)")
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.compression is not None and args.format in IMAGE_FORMATS:
+        try:
+            imwrite_params(args.format, args.compression)
+        except ValueError as e:
+            logging.error(str(e))
+            return 2
+    raw_dtype = np.dtype(args.raw_dtype).type if args.raw else None
+    cache_dir = None
+    if args.cache is not None:
+        cache_dir = FlowCache(args.cache or None).root
+
+    jobs = []
+    for video in videos:
+        if args.skip_existing and all(os.path.exists(path) for path in output_paths(video, args.output_dir, args.format, args.raw, args.stats)):
+            logging.info(f"Skipping {video}: outputs exist")
+            continue
+        jobs.append(video)
+
+    failed = 0
+    reports = {}
+    def report(video, result):
+        reports[video] = result
+        logging.info(f"Finished {video}: {result['frames']} frames in {result['elapsed']:.1f}s ({result['fps']:.1f} fps)")
+
+    if args.jobs <= 1 or len(jobs) <= 1:
+        for video in jobs:
+            logging.info(f"Processing {video}")
+            try:
+                report(video, run_job(video, params, args.output_dir, args.format, raw_dtype, cache_dir, args.stats, args.compression))
+            except Exception as e:
+                logging.error(f"Failed {video}: {e}")
+                failed += 1
+    else:
+        # Separate processes, so per-frame Python work in one job never holds up
+        # another. Each gets its share of the CPUs for tile threads and OpenCV's
+        # own thread pool, which would otherwise both size themselves to the
+        # whole machine in every process.
+        threads = max(1, (os.cpu_count() or 1) // args.jobs)
+        job_params = dict(params, tile_workers=params.get('tile_workers') or threads)
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=cv2.setNumThreads, initargs=(threads,)) as pool:
+            futures = {pool.submit(run_job, video, job_params, args.output_dir, args.format, raw_dtype, cache_dir, args.stats, args.compression): video
+                       for video in jobs}
+            for future in as_completed(futures):
+                video = futures[future]
+                try:
+                    report(video, future.result())
+                except Exception as e:
+                    logging.error(f"Failed {video}: {e}")
+                    failed += 1
+    logging.info(f"{len(jobs) - failed} of {len(jobs)} videos processed")
+    if args.profile:
+        write_report(reports, args.profile)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,135 @@
+# Frame sinks shared by GUI exports and the batch CLI. Encoding runs off the
+# producing thread: video frames pass through a bounded queue to a writer
+# thread, so a processing run and its encoder overlap with at most a queue's
+# worth of frames waiting, and image sequences are encoded by a thread pool
+# (cv2.imwrite releases the GIL). Every sink has write(frame), close(), which
+# raises any encoding error, and abort(), which stops and deletes the output.
+# Frames are kept by reference until encoded, so callers must not modify them
+# after write().
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import threading
+import cv2
+
+# Per image format: the cv2.imwrite flag, its valid range and default. PNG takes
+# a zlib level (higher is smaller and slower), JPEG a quality (higher is larger).
+IMAGE_FORMATS = {
+    'png': (cv2.IMWRITE_PNG_COMPRESSION, (0, 9), 3),
+    'jpg': (cv2.IMWRITE_JPEG_QUALITY, (0, 100), 95)
+}
+
+def imwrite_params(ext, compression=None):
+    flag, (low, high), default = IMAGE_FORMATS[ext]
+    level = default if compression is None else compression
+    if not low <= level <= high:
+        raise ValueError(f"Compression level for {ext} must be between {low} and {high}")
+    return [flag, int(level)]
+
+class VideoSink:
+    # MP4 writer on its own thread, opened on the first frame once the output
+    # size is known. write() blocks while max_queued frames are waiting.
+    def __init__(self, path, fps, max_queued=16):
+        self.path = path
+        self.fps = fps
+        self.count = 0
+        self._queue = queue.Queue(max_queued)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='VideoSink', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        writer = None
+        try:
+            while True:
+                frame = self._queue.get()
+                if frame is None:
+                    return
+                if writer is None:
+                    height, width = frame.shape[:2]
+                    writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*'mp4v'), self.fps, (width, height))
+                    if not writer.isOpened():
+                        raise ValueError(f"Could not open video writer for {self.path}")
+                writer.write(frame)
+        except Exception as e:
+            self._error = e
+            # Keep taking frames so a blocked write() or close() gets through.
+            while self._queue.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                writer.release()
+
+    def write(self, frame):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(frame)
+        self.count += 1
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def abort(self):
+        if not self._closed:
+            self._closed = True
+            # Frames still waiting are not worth encoding.
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._queue.put(None)
+            self._thread.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class ImageSink:
+    # Numbered frame_0000.<ext> files in `directory`, encoded by `workers`
+    # threads. write() waits for the oldest frame once 2 * workers are pending.
+    def __init__(self, directory, ext='png', compression=None, workers=None):
+        self.directory = directory
+        self.ext = ext
+        self.params = imwrite_params(ext, compression)
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+        workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='ImageSink')
+        self._pending = deque()
+        self._max_pending = 2 * workers
+
+    def _path(self, i):
+        return os.path.join(self.directory, f"frame_{i:04d}.{self.ext}")
+
+    def _encode(self, path, frame):
+        if not cv2.imwrite(path, frame, self.params):
+            raise ValueError(f"Could not write {path}")
+
+    def write(self, frame):
+        while len(self._pending) >= self._max_pending:
+            self._pending.popleft().result()
+        self._pending.append(self._pool.submit(self._encode, self._path(self.count), frame))
+        self.count += 1
+
+    def close(self):
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._pool.shutdown()
+
+    def abort(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pool.shutdown()
+        for i in range(self.count):
+            path = self._path(i)
+            if os.path.exists(path):
+                os.remove(path)
\ No newline at end of file
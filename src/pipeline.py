@@ -0,0 +1,549 @@
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+import cv2
+import numpy as np
+from src.cache import compact_result, expand_result
+from src.processors import create_flow_engine, FlowTraceEngine, FLOW_MODES
+from src.profiling import NULL_PROFILER
+from src.stats import FlowStatistics, NORMALIZE_MODES
+from src.storage import FrameStore
+from src.utils import preview_image, visualize_flow, visualize_flowtrace
+
+class Cancelled(Exception):
+    pass
+
+def check_cancel(cancel):
+    # Stages call this once per frame, so a set `cancel` event stops a run within
+    # one frame; the generators' cleanup then releases the capture.
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("Processing cancelled")
+
+def frame_context(params):
+    # Frames consumed before the first output: one for a flow pair,
+    # trace_length - 1 for a FlowTrace window.
+    return params['win_size'] - 1 if params['algorithm'] == "FlowTrace" else 1
+
+def sampled_frames(params):
+    return range(params['start_frame'], params['end_frame'] + 1, params['step'])
+
+def sampled_frame_count(params):
+    return len(sampled_frames(params))
+
+def output_count(params):
+    return max(0, sampled_frame_count(params) - frame_context(params))
+
+def output_frames(params):
+    # Video frame each output belongs to (the last frame of its pair or window).
+    return sampled_frames(params)[frame_context(params):]
+
+def validate_params(params):
+    # A window spans sampled frames, so with step > 1 fewer frames fit the range.
+    if params['algorithm'] == "FlowTrace" and params['win_size'] > sampled_frame_count(params):
+        raise ValueError("Trace length exceeds the frames sampled from the selected range")
+    if params.get('flow_mode', "Full") not in FLOW_MODES:
+        raise ValueError("Unknown flow mode")
+    if params.get('normalize', "Per Frame") not in NORMALIZE_MODES:
+        raise ValueError("Unknown normalization")
+    roi = params.get('roi')
+    if roi is not None and (len(roi) != 4 or roi[0] < 0 or roi[1] < 0 or roi[2] <= 0 or roi[3] <= 0):
+        raise ValueError("Region of interest must be (x, y, width, height) inside the frame")
+
+def collects_statistics(params, stats):
+    # Statistics describe flow magnitudes; FlowTrace runs have none.
+    return stats is not None and params['algorithm'] != "FlowTrace"
+
+def needs_global_range(params):
+    # "Global" normalization without an explicit mag_range has to know the
+    # statistics of the whole range before drawing the first frame.
+    return params['algorithm'] != "FlowTrace" and params.get('normalize') == "Global" and params.get('mag_range') is None
+
+def global_params(params, stats):
+    return dict(params, mag_range=stats.magnitude_range(params.get('norm_percentile', 99.0)))
+
+def crop_roi(frame, roi):
+    # View of the (x, y, width, height) region, clipped to the frame.
+    if roi is None:
+        return frame
+    x, y, w, h = roi
+    frame = frame[y:y + h, x:x + w]
+    if frame.size == 0:
+        raise ValueError("Region of interest lies outside the frame")
+    return frame
+
+class BufferPool:
+    # Fixed set of preallocated grayscale buffers shared by the decode and compute
+    # stages. acquire() blocks until a buffer is released, which is what applies
+    # backpressure to the decoder.
+    def __init__(self, size):
+        self.size = size
+        self._free = queue.Queue()
+        self._allocated = 0
+        self._closed = threading.Event()
+
+    def acquire(self, shape):
+        if self._allocated < self.size:
+            self._allocated += 1
+            return np.empty(shape, dtype=np.uint8)
+        while not self._closed.is_set():
+            try:
+                buf = self._free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            return buf if buf.shape == shape else np.empty(shape, dtype=np.uint8)
+        raise RuntimeError("Buffer pool closed")
+
+    def release(self, buf):
+        self._free.put(buf)
+
+    def close(self):
+        self._closed.set()
+
+_DONE = object()
+
+def prefetch(iterable, depth):
+    # Runs `iterable` on a background thread, handing items over through a queue
+    # of at most `depth` entries so the producer blocks once it is that far ahead.
+    # Exceptions are re-raised in the consumer; closing the generator stops the
+    # producer at its next hand-off.
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_DONE, None))
+        except BaseException as e:
+            put((_DONE, e))
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+class FrameReader:
+    # Reads an increasing sequence of frame indices from a capture. Frames in
+    # between are skipped with grab(), which demuxes and decodes but never
+    # converts or copies them out. When a keyframe lies far enough past the
+    # current position the reader seeks to it instead, since decoding from there
+    # is cheaper. Seeks always land on a keyframe (or go through OpenCV's own
+    # seek when keyframes are unknown) and grab forward, so they are exact.
+    MIN_SEEK_SAVING = 16  # frames a seek has to save to beat grabbing
+    BLIND_SEEK_GAP = 300  # without a keyframe index, longer than any common GOP
+
+    def __init__(self, cap, frame_index=None):
+        self.cap = cap
+        self.keyframes = (frame_index or {}).get('keyframes')
+        self.position = None
+
+    def _seek(self, index):
+        target = index
+        if self.keyframes:
+            i = bisect_right(self.keyframes, index)
+            target = self.keyframes[i - 1] if i > 0 else 0
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        self.position = target
+
+    def _should_seek(self, index):
+        if self.position is None or index < self.position:
+            return True
+        if self.keyframes:
+            i = bisect_right(self.keyframes, index)
+            return i > 0 and self.keyframes[i - 1] - self.position >= self.MIN_SEEK_SAVING
+        return index - self.position >= self.BLIND_SEEK_GAP
+
+    def read(self, index):
+        if self._should_seek(index):
+            self._seek(index)
+        while self.position < index:
+            if not self.cap.grab():
+                return False, None
+            self.position += 1
+        ret, frame = self.cap.read()
+        self.position += 1
+        return ret, frame
+
+class ThumbnailIndex:
+    # Low-resolution RGB thumbnails at increasing frame positions, filled by
+    # build_thumbnails() on a background thread while readers look up the
+    # nearest one.
+    def __init__(self):
+        self.positions = []
+        self.images = []
+        self.complete = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, position, image):
+        with self._lock:
+            self.positions.append(position)
+            self.images.append(image)
+
+    def nearest(self, index):
+        # (position, image) of the thumbnail closest to `index`, or None while empty.
+        with self._lock:
+            if not self.positions:
+                return None
+            i = bisect_right(self.positions, index)
+            if i == len(self.positions) or (i > 0 and index - self.positions[i - 1] <= self.positions[i] - index):
+                i -= 1
+            return self.positions[i], self.images[i]
+
+def build_thumbnails(cap, frame_count, thumbnails, size=(160, 120), frame_index=None, max_thumbnails=1000, cancel=None):
+    # One pass over the video, keeping a thumbnail every ceil(frame_count /
+    # max_thumbnails) frames. FrameReader grabs or seeks past the frames in
+    # between, so only the kept frames are converted and scaled.
+    stride = max(1, -(-frame_count // max_thumbnails))
+    reader = FrameReader(cap, frame_index)
+    for position in range(0, frame_count, stride):
+        check_cancel(cancel)
+        ret, frame = reader.read(position)
+        if not ret:
+            break
+        thumbnails.add(position, preview_image(frame, size))
+    thumbnails.complete = True
+    return thumbnails
+
+def decode_frames(reader, indices, pool, roi=None, profiler=NULL_PROFILER, cancel=None):
+    # Decode stage: (BGR frame, pooled grayscale copy) for each requested index,
+    # both cropped to the region of interest so later stages only see that.
+    for index in indices:
+        check_cancel(cancel)
+        with profiler.stage('decode'):
+            ret, frame = reader.read(index)
+        if not ret:
+            break
+        frame = crop_roi(frame, roi)
+        buf = pool.acquire(frame.shape[:2])
+        with profiler.stage('grayscale'):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buf)
+        yield frame, gray
+
+def compute_results(frames, params, pool, flow_buffers, profiler=NULL_PROFILER):
+    # Compute stage: (frame, flow or trace) per output. Grayscale buffers go back
+    # to the pool as soon as the engines are done with them.
+    if params['algorithm'] == "FlowTrace":
+        engine = None
+        for frame, gray in frames:
+            if engine is None:
+                engine = FlowTraceEngine(gray.shape, params)
+            with profiler.stage('compute'):
+                trace = engine.push(gray)
+            pool.release(gray)
+            if trace is not None:
+                yield frame, trace
+    else:
+        flow_engine = create_flow_engine(params, buffers=flow_buffers)
+        prev_gray = None
+        try:
+            for frame, gray in frames:
+                if prev_gray is not None:
+                    with profiler.stage('compute'):
+                        flow = flow_engine.calc(prev_gray, gray)
+                    pool.release(prev_gray)
+                    yield frame, flow
+                prev_gray = gray
+        finally:
+            flow_engine.close()
+
+def process_frames(cap, params, indices, depth=0, raw_dtype=None, profiler=NULL_PROFILER, cancel=None, stats=None, render=True):
+    # Decode the frames at `indices` and yield (frame, raw, visualization) for
+    # every output they produce; raw is a copy of the flow field (as raw_dtype)
+    # or trace when raw_dtype is given, else None. Flow fields are added to
+    # `stats` in order; visualization is None when render is False. With depth > 0, decoding and computation
+    # each run on their own thread, connected by queues of `depth` entries, and
+    # visualization happens in the caller, so throughput approaches the slowest
+    # stage rather than the sum of all three.
+    # Grayscale buffers in flight: the queued frames, the one being decoded and
+    # the compute stage's previous and current frame.
+    pool = BufferPool(depth + 3)
+    frames = decode_frames(FrameReader(cap, params.get('frame_index')), indices, pool, params.get('roi'), profiler, cancel)
+    if depth > 0:
+        frames = prefetch(frames, depth)
+    # Flow buffers in flight: the queued results, one blocked hand-off, one being
+    # visualized and the one being computed.
+    results = compute_results(frames, params, pool, depth + 3, profiler)
+    if depth > 0:
+        results = prefetch(results, depth)
+    visualize = visualize_flowtrace if params['algorithm'] == "FlowTrace" else visualize_flow
+    collect = collects_statistics(params, stats)
+    try:
+        for frame, result in results:
+            check_cancel(cancel)
+            raw = None
+            if raw_dtype is not None:
+                with profiler.stage('raw_copy'):
+                    raw = compact_result(result, raw_dtype)
+            if collect:
+                with profiler.stage('stats'):
+                    stats.add(result)
+            viz = None
+            if render:
+                with profiler.stage('visualize'):
+                    viz = visualize(result, frame.shape, params)
+            yield frame, raw, viz
+    finally:
+        pool.close()
+        results.close()
+        frames.close()
+
+def plan_chunks(params, chunk_size, first_output=0):
+    # (first sampled frame, frame count) per chunk. Each chunk re-reads the frame
+    # context before its first output, so every output is produced exactly once.
+    context = frame_context(params)
+    total = sampled_frame_count(params)
+    return [(first - context, min(first + chunk_size, total) - first + context)
+            for first in range(context + first_output, total, chunk_size)]
+
+# Parallel chunks hold their outputs until the consumer reaches them, so their
+# length is bounded by the bytes those outputs take (besides a frame count that
+# keeps small frames in several chunks). Only the source frame of every
+# FRAME_STRIDE-th output is kept: the frames only feed throttled previews.
+CHUNK_BYTES = 128 << 20
+FRAME_STRIDE = 8
+
+def default_chunk_size(video_path, params, raw_dtype=None, render=True):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        w, h = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    roi = params.get('roi')
+    if roi is not None:
+        w, h = min(w, roi[2]), min(h, roi[3])
+    per_pixel = 3 / FRAME_STRIDE + (3 if render else 0)
+    if raw_dtype is not None:
+        per_pixel += 1 if params['algorithm'] == "FlowTrace" else 2 * np.dtype(raw_dtype).itemsize
+    size = max(32, 4 * frame_context(params))
+    if w * h > 0:
+        size = min(size, max(1, int(CHUNK_BYTES // (w * h * per_pixel))))
+    return size
+
+def chunk_outputs(video_path, params, first, count, raw_dtype=None, profiler=NULL_PROFILER, cancel=None, stats=None, render=True):
+    # One chunk's (frame, raw, visualization) on its own capture; frame is None
+    # except for every FRAME_STRIDE-th output and the chunk's last.
+    cap = cv2.VideoCapture(video_path)
+    try:
+        indices = sampled_frames(params)[first:first + count]
+        last = len(indices) - frame_context(params) - 1
+        for i, (frame, raw, viz) in enumerate(process_frames(cap, params, indices, 0, raw_dtype, profiler, cancel, stats, render)):
+            yield (frame if i % FRAME_STRIDE == 0 or i == last else None), raw, viz
+    finally:
+        cap.release()
+
+def iter_outputs(video_path, params, raw_dtype=None, profiler=NULL_PROFILER, cancel=None, first_output=0, stats=None, render=True):
+    # Yields (frame, raw, visualization) in frame order, starting at output
+    # `first_output`. With params['workers'] > 1 the range is split into
+    # overlapping chunks decoded and processed on a thread pool (OpenCV releases
+    # the GIL); results are identical to the serial path, but most frames come
+    # out as None (see FRAME_STRIDE). Each chunk collects its own statistics,
+    # merged into `stats` in chunk order.
+    workers = params.get('workers', 1)
+    if workers <= 1 or params.get('warm_start'):
+        # Warm starts chain every pair to the previous flow, so they stay serial.
+        # A run starting past output 0 begins cold, like a chunk would.
+        cap = cv2.VideoCapture(video_path)
+        try:
+            indices = sampled_frames(params)[first_output:]
+            yield from process_frames(cap, params, indices, params.get('prefetch', 4), raw_dtype, profiler, cancel, stats, render)
+        finally:
+            cap.release()
+        return
+    chunk_size = params.get('chunk_size') or default_chunk_size(video_path, params, raw_dtype, render)
+    chunks = iter(plan_chunks(params, chunk_size, first_output))
+    stop = threading.Event()
+
+    def run_chunk(chunk, outputs, chunk_stats):
+        # Hands outputs over as they are made; a chunk never queues more than
+        # its own outputs, so the puts never block.
+        try:
+            for item in chunk_outputs(video_path, params, *chunk, raw_dtype, profiler, cancel, chunk_stats, render):
+                if stop.is_set():
+                    return
+                outputs.put((item, None))
+            outputs.put((_DONE, None))
+        except BaseException as e:
+            outputs.put((_DONE, e))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # The chunk being consumed, the others running and one waiting for a thread.
+        open_chunks = deque()
+
+        def submit():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                check_cancel(cancel)
+                outputs = queue.Queue()
+                chunk_stats = FlowStatistics() if stats is not None else None
+                open_chunks.append((pool.submit(run_chunk, chunk, outputs, chunk_stats), outputs, chunk_stats))
+
+        try:
+            for _ in range(workers + 1):
+                submit()
+            while open_chunks:
+                _, outputs, chunk_stats = open_chunks[0]
+                while True:
+                    item, error = outputs.get()
+                    if error is not None:
+                        raise error
+                    if item is _DONE:
+                        break
+                    yield item
+                if chunk_stats is not None:
+                    stats.merge(chunk_stats)
+                open_chunks.popleft()
+                submit()
+        finally:
+            stop.set()
+            for future, _, _ in open_chunks:
+                future.cancel()
+
+def render_result(raw, params):
+    # Visualization of one cached raw output (flow field or trace).
+    result = expand_result(raw)
+    visualize = visualize_flowtrace if params['algorithm'] == "FlowTrace" else visualize_flow
+    return visualize(result, result.shape, params)
+
+def render_outputs(params, store, profiler=NULL_PROFILER, cancel=None, first_output=0):
+    # Yields the visualization of every cached raw output from `first_output`
+    # on, without opening the video: what a display-only parameter change needs.
+    for i in range(first_output, len(store)):
+        check_cancel(cancel)
+        with profiler.stage('visualize'):
+            viz = render_result(store[i], params)
+        yield viz
+
+def replay_outputs(video_path, params, store, profiler=NULL_PROFILER, cancel=None, first_output=0, stats=None):
+    # Re-renders cached raw outputs with the current display parameters. The
+    # flow engine is never run; frames are decoded only for the side-by-side view.
+    indices = output_frames(params)[:len(store)]
+    visualize = visualize_flowtrace if params['algorithm'] == "FlowTrace" else visualize_flow
+    collect = collects_statistics(params, stats)
+    cap = cv2.VideoCapture(video_path)
+    try:
+        reader = FrameReader(cap, params.get('frame_index'))
+        for i in range(first_output, len(indices)):
+            check_cancel(cancel)
+            index, raw = indices[i], store[i]
+            with profiler.stage('decode'):
+                ret, frame = reader.read(index)
+            if not ret:
+                break
+            frame = crop_roi(frame, params.get('roi'))
+            with profiler.stage('cache_read'):
+                result = expand_result(raw)
+            if collect:
+                with profiler.stage('stats'):
+                    stats.add(result)
+            with profiler.stage('visualize'):
+                viz = visualize(result, frame.shape, params)
+            yield frame, viz
+    finally:
+        cap.release()
+
+def stored_statistics(store, cancel=None):
+    # Magnitude statistics of a cache entry: recorded when it was written, or
+    # recomputed from its raw outputs for entries written before they were.
+    if 'stats' in store.metadata:
+        return FlowStatistics.from_dict(store.metadata['stats'])
+    stats = FlowStatistics()
+    for raw in store:
+        check_cancel(cancel)
+        stats.add(expand_result(raw))
+    return stats
+
+def global_outputs(video_path, params, cache=None, profiler=NULL_PROFILER, cancel=None, first_output=0, stats=None):
+    # Global normalization in two passes, neither holding more than a chunk of
+    # flow fields in memory: the first computes the raw outputs into a cache
+    # entry (or a temporary store) while collecting their statistics, the second
+    # replays them against the whole range's magnitude percentiles. The temporary
+    # store keeps flow fields as float16 like cache entries, so the spill costs
+    # 4 bytes per pixel and output (about 8 MB per 1080p field) instead of 8.
+    store = cache.create(video_path, params) if cache is not None else FrameStore()
+    raw_dtype = cache.flow_dtype if cache is not None else np.float16
+    run_stats = FlowStatistics()
+    try:
+        for _, raw, _ in iter_outputs(video_path, params, raw_dtype, profiler, cancel, stats=run_stats, render=False):
+            with profiler.stage('cache_write'):
+                store.append(raw)
+        if cache is not None:
+            store.metadata['stats'] = run_stats.to_dict()
+            store = cache.commit(store)
+    except BaseException:
+        if cache is not None:
+            cache.discard(store)
+        else:
+            store.close()
+        raise
+    try:
+        yield from replay_outputs(video_path, global_params(params, run_stats), store, profiler, cancel, first_output, stats)
+    finally:
+        store.close()
+
+def iter_results(video_path, params, cache=None, profiler=NULL_PROFILER, cancel=None, first_output=0, stats=None):
+    # Yields (frame, visualization) in frame order, from output `first_output`
+    # on; frame is None where a parallel run dropped it. With a FlowCache, a
+    # complete entry for this video and these compute parameters is replayed
+    # instead of recomputed; otherwise the raw outputs are written to a new
+    # entry that is committed once the run finishes. Setting
+    # `cancel` raises Cancelled within a frame and discards the unfinished entry.
+    # Flow magnitude statistics of the yielded outputs go into `stats`.
+    store = cache.lookup(video_path, params) if cache is not None else None
+    if store is not None:
+        try:
+            if needs_global_range(params):
+                params = global_params(params, stored_statistics(store, cancel))
+            yield from replay_outputs(video_path, params, store, profiler, cancel, first_output, stats)
+        finally:
+            store.close()
+        return
+    if needs_global_range(params):
+        yield from global_outputs(video_path, params, cache, profiler, cancel, first_output, stats)
+        return
+    if cache is None or first_output > 0:
+        # A resumed run only covers part of the range, so it cannot fill an entry.
+        for frame, _, viz in iter_outputs(video_path, params, profiler=profiler, cancel=cancel, first_output=first_output, stats=stats):
+            yield frame, viz
+        return
+    # Entries record the statistics of the whole range for later global normalization.
+    run_stats = stats if stats is not None else FlowStatistics()
+    store = cache.create(video_path, params)
+    try:
+        for frame, raw, viz in iter_outputs(video_path, params, cache.flow_dtype, profiler, cancel, stats=run_stats):
+            with profiler.stage('cache_write'):
+                store.append(raw)
+            yield frame, viz
+    except BaseException:
+        cache.discard(store)
+        raise
+    if params['algorithm'] != "FlowTrace":
+        store.metadata['stats'] = run_stats.to_dict()
+    cache.commit(store).close()
\ No newline at end of file
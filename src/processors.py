@@ -1,26 +1,406 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
 import cv2
 import numpy as np
 
-def compute_flow(prev, next, params):
-    # Stub: Implement based on algorithm
-    if params['algorithm'] == "Farneback":
+# Flow algorithms by display name. Each entry is a factory taking the params dict
+# and returning a backend with calc(prev, next, flow, warm) -> flow, where flow is
+# a reusable (H, W, 2) float32 buffer and warm asks for it to be used as the
+# initial estimate.
+FLOW_ALGORITHMS = {}
+
+def register_flow_algorithm(name):
+    def decorator(factory):
+        FLOW_ALGORITHMS[name] = factory
+        return factory
+    return decorator
+
+def warm_iterations(params, iterations):
+    # Warm-started solves begin close to the answer and need fewer iterations.
+    return params.get('warm_iterations') or max(1, (iterations + 1) // 2)
+
+@register_flow_algorithm("Farneback")
+class FarnebackFlow:
+    def __init__(self, params):
+        self.levels = params['pyr_levels']
+        self.win_size = params['win_size']
+        self.iterations = params['iterations']
+        self.warm_iterations = warm_iterations(params, self.iterations)
+
+    def calc(self, prev, next, flow, warm):
         return cv2.calcOpticalFlowFarneback(
-            prev, next, None,
-            pyr_scale=0.5, levels=params['pyr_levels'], winsize=params['win_size'],
-            iterations=params['iterations'], poly_n=5, poly_sigma=1.2, flags=0
+            prev, next, flow,
+            pyr_scale=0.5, levels=self.levels, winsize=self.win_size,
+            iterations=self.warm_iterations if warm else self.iterations, poly_n=5, poly_sigma=1.2,
+            flags=cv2.OPTFLOW_USE_INITIAL_FLOW if warm else 0
         )
-    elif params['algorithm'] == "Dense Optical Flow":
-        # Use Farneback as default or DIS
-        return cv2.DISOpticalFlow.create(cv2.DISOPTICAL_FLOW_PRESET_MEDIUM).calc(prev, next, None)
-    else:
+
+class DISFlow:
+    def __init__(self, params, preset):
+        self.dis = cv2.DISOpticalFlow.create(preset)
+        self.iterations = self.dis.getGradientDescentIterations()
+        self.warm_iterations = warm_iterations(params, self.iterations)
+
+    def calc(self, prev, next, flow, warm):
+        self.dis.setGradientDescentIterations(self.warm_iterations if warm else self.iterations)
+        # DIS treats any same-sized flow argument as an initial guess, so a cold
+        # solve has to start from nothing.
+        return self.dis.calc(prev, next, flow if warm else None)
+
+register_flow_algorithm("Dense Optical Flow")(lambda params: DISFlow(params, cv2.DISOPTICAL_FLOW_PRESET_MEDIUM))
+register_flow_algorithm("DIS (Fast)")(lambda params: DISFlow(params, cv2.DISOPTICAL_FLOW_PRESET_FAST))
+register_flow_algorithm("DIS (Ultrafast)")(lambda params: DISFlow(params, cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST))
+
+if hasattr(cv2, 'optflow'):  # opencv-contrib only
+    @register_flow_algorithm("TV-L1")
+    class TVL1Flow:
+        def __init__(self, params):
+            self.tvl1 = cv2.optflow.DualTVL1OpticalFlow_create(
+                nscales=params['pyr_levels'], warps=params['iterations'])
+
+        def calc(self, prev, next, flow, warm):
+            self.tvl1.setUseInitialFlow(warm)
+            return self.tvl1.calc(prev, next, flow)
+
+def create_flow_backend(params):
+    factory = FLOW_ALGORITHMS.get(params['algorithm'])
+    if factory is None:
         raise ValueError("Unknown algorithm")
+    return factory(params)
+
+class _FlowBuffers:
+    # Rotation of (H, W, 2) float32 output buffers. A returned flow stays valid
+    # until `buffers` further calls, so consumers that keep flows longer must copy them.
+    def __init__(self, buffers):
+        self._buffers = [None] * max(2, buffers)
+        self._next = 0
+
+    def _next_buffer(self, h, w):
+        buf = self._buffers[self._next]
+        if buf is None or buf.shape[:2] != (h, w):
+            buf = self._buffers[self._next] = np.zeros((h, w, 2), dtype=np.float32)
+        self._next = (self._next + 1) % len(self._buffers)
+        return buf
+
+    def close(self):
+        pass
+
+class FlowEngine(_FlowBuffers):
+    # Created once per job: holds the configured backend, a rotation of output
+    # buffers and the previous flow field.
+    def __init__(self, params, buffers=2):
+        super().__init__(buffers)
+        self.backend = create_flow_backend(params)
+        self.warm_start = params.get('warm_start', False)
+        self.prev_flow = None
+
+    def reset(self):
+        # Drop the warm-start state, e.g. after a seek or scene cut.
+        self.prev_flow = None
+
+    def calc(self, prev, next):
+        buf = self._next_buffer(*prev.shape[:2])
+        warm = self.warm_start and self.prev_flow is not None
+        if warm:
+            np.copyto(buf, self.prev_flow)
+        self.prev_flow = self.backend.calc(prev, next, buf, warm)
+        return self.prev_flow
+
+class CoarseFlowEngine(_FlowBuffers):
+    # Solves at params['flow_scale'] of the input size and upsamples the field
+    # bilinearly. Vectors are in pixels, so each component is multiplied by the
+    # size ratio along its axis. Warm starts chain at the coarse resolution.
+    def __init__(self, params, buffers=2):
+        super().__init__(buffers)
+        self.scale = params.get('flow_scale', 0.5)
+        if not 0 < self.scale <= 1:
+            raise ValueError("Flow scale must be between 0 and 1")
+        self.inner = FlowEngine(params)
+        self._small = None
+
+    def reset(self):
+        self.inner.reset()
+
+    def calc(self, prev, next):
+        h, w = prev.shape[:2]
+        size = (max(1, round(w * self.scale)), max(1, round(h * self.scale)))
+        if self._small is None or self._small[0].shape != size[::-1]:
+            self._small = [np.empty(size[::-1], dtype=np.uint8) for _ in range(2)]
+            self._ratio = np.array([w / size[0], h / size[1]], dtype=np.float32)
+        small_prev = cv2.resize(prev, size, dst=self._small[0], interpolation=cv2.INTER_AREA)
+        small_next = cv2.resize(next, size, dst=self._small[1], interpolation=cv2.INTER_AREA)
+        small_flow = self.inner.calc(small_prev, small_next)
+        buf = self._next_buffer(h, w)
+        cv2.resize(small_flow, (w, h), dst=buf, interpolation=cv2.INTER_LINEAR)
+        np.multiply(buf, self._ratio, out=buf)
+        return buf
+
+def tile_starts(length, tile, overlap):
+    # Tile origins along one axis: `tile` long, consecutive tiles sharing at
+    # least `overlap` pixels, the last one flush with the end.
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, tile - overlap))
+    return starts + [length - tile]
+
+def _feather(length, start, stop, overlap):
+    # 1D blend weights for a tile covering [start, stop): linear ramps across
+    # the overlap on sides that have a neighbour, flat at the frame border.
+    weight = np.ones(stop - start, dtype=np.float32)
+    ramp = np.arange(1, overlap + 1, dtype=np.float32) / (overlap + 1)
+    if overlap and start > 0:
+        weight[:overlap] = np.minimum(weight[:overlap], ramp)
+    if overlap and stop < length:
+        weight[-overlap:] = np.minimum(weight[-overlap:], ramp[::-1])
+    return weight
+
+class TiledFlowEngine(_FlowBuffers):
+    # Splits the frame into params['tile_size'] tiles overlapping by
+    # params['tile_overlap'] pixels, solves them on a thread pool (OpenCV
+    # releases the GIL) and blends the overlaps with feathered weights. Each tile
+    # has its own backend and warm-start state, so tiles are independent and the
+    # result does not depend on the number of threads.
+    def __init__(self, params, buffers=2):
+        super().__init__(buffers)
+        self.params = params
+        self.tile = params.get('tile_size', 512)
+        self.overlap = params.get('tile_overlap', 32)
+        if self.tile < 16 or not 0 <= self.overlap < self.tile // 2:
+            raise ValueError("Tile size must be at least 16 and overlap less than half of it")
+        self.workers = params.get('tile_workers') or os.cpu_count() or 1
+        self.shape = None
+        self._executor = None
+
+    def _layout(self, h, w):
+        self.shape = (h, w)
+        self.tiles = []
+        total = np.zeros((h, w), dtype=np.float32)
+        for y in tile_starts(h, self.tile, self.overlap):
+            for x in tile_starts(w, self.tile, self.overlap):
+                ys = slice(y, min(y + self.tile, h))
+                xs = slice(x, min(x + self.tile, w))
+                weight = np.outer(_feather(h, ys.start, ys.stop, self.overlap),
+                                  _feather(w, xs.start, xs.stop, self.overlap))
+                total[ys, xs] += weight
+                th, tw = ys.stop - ys.start, xs.stop - xs.start
+                # Contiguous copies of the tile, which DIS requires.
+                grays = (np.empty((th, tw), dtype=np.uint8), np.empty((th, tw), dtype=np.uint8))
+                out = np.empty((th, tw, 2), dtype=np.float32)
+                self.tiles.append((ys, xs, FlowEngine(self.params), weight[..., None], grays, out))
+        self.inv_total = (1 / total)[..., None]
+
+    def reset(self):
+        if self.shape is not None:
+            for tile in self.tiles:
+                tile[2].reset()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def calc(self, prev, next):
+        h, w = prev.shape[:2]
+        if self.shape != (h, w):
+            self._layout(h, w)
+        if self._executor is None and self.workers > 1 and len(self.tiles) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        def solve(tile):
+            ys, xs, engine, weight, (tile_prev, tile_next), out = tile
+            np.copyto(tile_prev, prev[ys, xs])
+            np.copyto(tile_next, next[ys, xs])
+            return np.multiply(engine.calc(tile_prev, tile_next), weight, out=out)
+
+        solved = self._executor.map(solve, self.tiles) if self._executor else map(solve, self.tiles)
+        buf = self._next_buffer(h, w)
+        buf.fill(0)
+        for (ys, xs, *_), weighted in zip(self.tiles, solved):
+            buf[ys, xs] += weighted
+        np.multiply(buf, self.inv_total, out=buf)
+        return buf
+
+# Processing modes for flow algorithms: whole frame, downscaled, or tiled.
+FLOW_MODES = {"Full": FlowEngine, "Coarse": CoarseFlowEngine, "Tiled": TiledFlowEngine}
+
+def create_flow_engine(params, buffers=2):
+    engine = FLOW_MODES.get(params.get('flow_mode', "Full"))
+    if engine is None:
+        raise ValueError("Unknown flow mode")
+    return engine(params, buffers)
+
+def compute_flow(prev, next, params):
+    # One-off pair; use FlowEngine when processing a sequence.
+    return create_flow_backend(params).calc(prev, next, None, False)
+
+TRACE_CHUNK_BYTES = 8 << 20  # most of a stack compute_flowtrace copies at once
+
+def compute_flowtrace(stack, params, out=None):
+    # Max projection of a (length, H, W) uint8 stack, minus the per-pixel median
+    # with bg_subtract; returns a 2D uint8 trace. Works in uint8 and int16 on
+    # bands of rows, so besides the stack itself it only holds one band's
+    # partitioned copy (at most TRACE_CHUNK_BYTES) and an int16 band:
+    # - max(clip(s - median)) == max(s) - median, since max(s) >= median; an
+    #   even length's half-integer median truncates like the float path did,
+    #   hence (2 * max - lo - hi) >> 1 with the two middle ranks lo and hi.
+    # - Inversion never copies the stack: max(255 - s) == 255 - min(s), and the
+    #   inverted middle ranks are 255 - hi and 255 - lo.
+    length, h, w = stack.shape
+    trace = out if out is not None else np.empty((h, w), dtype=np.uint8)
+    invert, bg_subtract = params['invert'], params['bg_subtract']
+    lo_rank, hi_rank = (length - 1) // 2, length // 2
+    rows = max(1, TRACE_CHUNK_BYTES // (length * w))
+    acc = np.empty((min(rows, h), w), dtype=np.int16) if bg_subtract else None
+    for y in range(0, h, rows):
+        band = stack[:, y:y + rows]
+        dst = trace[y:y + rows]
+        (np.min if invert else np.max)(band, axis=0, out=dst)
+        if not bg_subtract:
+            if invert:
+                np.subtract(255, dst, out=dst)
+            continue
+        part = np.partition(band, [lo_rank, hi_rank], axis=0)
+        diff = acc[:dst.shape[0]]
+        np.add(part[lo_rank], part[hi_rank], out=diff, dtype=np.int16)
+        if invert:
+            # (lo + hi - 2 * min) >> 1
+            np.subtract(diff, dst, out=diff, dtype=np.int16)
+            np.subtract(diff, dst, out=diff, dtype=np.int16)
+        else:
+            # (2 * max - lo - hi) >> 1
+            np.subtract(dst, diff, out=diff, dtype=np.int16)
+            np.add(diff, dst, out=diff, dtype=np.int16)
+        np.right_shift(diff, 1, out=diff)
+        np.copyto(dst, diff, casting='unsafe')
+        del part
+    return trace
+
+class _RunningRank:
+    # Tracks the rank-th smallest value per pixel over a shared per-pixel histogram
+    # (flattened, 256 bins per pixel). Invariant: below <= rank < below + count(value),
+    # so swapping one sample only walks the pointer across the bins in between.
+    def __init__(self, hist, bins, window, rank):
+        self.hist = hist
+        self.bins = bins
+        self.rank = rank
+        self.value = np.partition(window, rank, axis=0)[rank].astype(np.int16)
+        self.below = np.sum(window < self.value[None, :], axis=0, dtype=np.int32)
+
+    def update(self, removed, added):
+        value, below, hist, bins, rank = self.value, self.below, self.hist, self.bins, self.rank
+        below += added < value
+        below -= removed < value
+        idx = np.flatnonzero(below > rank)
+        while idx.size:
+            value[idx] -= 1
+            below[idx] -= hist[bins[idx] + value[idx]]
+            idx = idx[below[idx] > rank]
+        idx = np.flatnonzero(below + hist[bins + value] <= rank)
+        while idx.size:
+            below[idx] += hist[bins[idx] + value[idx]]
+            value[idx] += 1
+            idx = idx[below[idx] + hist[bins[idx] + value[idx]] <= rank]
+
+class FlowTraceEngine:
+    # Stateful equivalent of compute_flowtrace over a sliding window of frames.
+    # Frames go into a preallocated uint8 ring buffer; the window max uses the
+    # van Herk/Gil-Werman split (suffix maxima of the previous block + running
+    # prefix max of the current one) and the median background is kept by a
+    # per-pixel histogram, so each push costs O(pixels) regardless of trace length.
+    # The histogram holds 256 bins per pixel (530 MB at 1080p, 2 GB at 4K) and its
+    # rank walk only beats partitioning the ring from about 12 frames (measured at
+    # 480p and 1080p), so shorter windows and frames whose histogram would exceed
+    # HISTOGRAM_MAX_BYTES partition the ring on every push instead. The suffix
+    # maxima take a second window-sized buffer. With params['trace_compact']
+    # the engine keeps only the uint8 ring and runs compute_flowtrace over it on
+    # every push: O(pixels * length) per frame, but peak memory stays near the
+    # window's uint8 frames.
+    HISTOGRAM_MIN_LENGTH = 16
+    HISTOGRAM_MAX_BYTES = 1 << 30
+
+    def __init__(self, shape, params):
+        self.length = params['win_size']
+        self.invert = params['invert']
+        self.bg_subtract = params['bg_subtract']
+        self.compact = params.get('trace_compact', False)
+        self.shape = tuple(shape[:2])
+        length, (h, w) = self.length, self.shape
+        self.ring = np.empty((length, h, w), dtype=np.uint8)
+        self.suffix = None if self.compact else np.empty((length, h, w), dtype=np.uint8)
+        self.prefix = None if self.compact else np.empty((h, w), dtype=np.uint8)
+        self.hist = None
+        # 256 bins per pixel; counts never exceed the trace length.
+        count_dtype = np.uint8 if length <= 0xFF else np.uint16 if length <= 0xFFFF else np.uint32
+        hist_bytes = h * w * 256 * np.dtype(count_dtype).itemsize
+        if (self.bg_subtract and not self.compact and length >= self.HISTOGRAM_MIN_LENGTH
+                and hist_bytes <= self.HISTOGRAM_MAX_BYTES):
+            self.hist = np.zeros(h * w * 256, dtype=count_dtype)
+            self._bins = np.arange(0, h * w * 256, 256, dtype=np.intp)
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._ranks = None
+        if self.hist is not None:
+            self.hist.fill(0)
+
+    def push(self, gray):
+        # Returns the trace for the window ending at this frame, or None while filling.
+        length = self.length
+        pos = self.count % length
+        slot = self.ring[pos]
+        if self.compact:
+            # Window order does not matter to a max or a median; compute_flowtrace
+            # also applies the inversion.
+            slot[...] = gray
+            self.count += 1
+            if self.count < length:
+                return None
+            return compute_flowtrace(self.ring, {'invert': self.invert, 'bg_subtract': self.bg_subtract})
+        removed = slot.ravel().copy() if self.hist is not None and self.count >= length else None
+        if self.invert:
+            np.subtract(255, gray, out=slot)
+        else:
+            slot[...] = gray
+        if pos == 0:
+            self.prefix[...] = slot
+        else:
+            np.maximum(self.prefix, slot, out=self.prefix)
+        if pos == length - 1:
+            # Block complete: its suffix maxima serve the windows of the next block.
+            self.suffix[length - 1] = slot
+            for j in range(length - 2, 0, -1):
+                np.maximum(self.ring[j], self.suffix[j + 1], out=self.suffix[j])
+        self.count += 1
+
+        if self.hist is not None:
+            added = slot.ravel()
+            self.hist[self._bins + added] += 1
+            if removed is not None:
+                self.hist[self._bins + removed] -= 1
+                for tracker in self._ranks:
+                    tracker.update(removed, added)
+            elif self.count == length:
+                window = self.ring.reshape(length, -1)
+                ranks = sorted({(length - 1) // 2, length // 2})
+                self._ranks = [_RunningRank(self.hist, self._bins, window, r) for r in ranks]
 
-def compute_flowtrace(stack, params):
-    if params['invert']:
-        stack = 255 - stack  # Assuming uint8 grayscale.
-    if params['bg_subtract']:
-        bg = np.median(stack, axis=0)
-        stack = stack - bg[None, :, :]
-        stack = np.clip(stack, 0, 255)
-    trace = np.max(stack, axis=0).astype(np.uint8)
-    return trace  # 2D grayscale array.
\ No newline at end of file
+        if self.count < length:
+            return None
+        if pos == length - 1:
+            trace = self.prefix.copy()
+        else:
+            trace = np.maximum(self.suffix[pos + 1], self.prefix)
+        if not self.bg_subtract:
+            return trace
+        # max(clip(s - median)) == max(s) - median since max(s) >= median; for even
+        # lengths the median is a half-integer and the float path truncates it.
+        if self.hist is not None:
+            lo = self._ranks[0].value.reshape(self.shape)
+            hi = self._ranks[-1].value.reshape(self.shape)
+        else:
+            lo_rank, hi_rank = (length - 1) // 2, length // 2
+            part = np.partition(self.ring, [lo_rank, hi_rank], axis=0)
+            lo, hi = part[lo_rank], part[hi_rank]
+        diff = 2 * trace.astype(np.int16) - lo - hi
+        return (diff >> 1).astype(np.uint8)
\ No newline at end of file
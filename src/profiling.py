@@ -0,0 +1,202 @@
+from collections import deque
+import csv
+import json
+import math
+import threading
+import time
+import numpy as np
+
+class _StageTimer:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _StageTotals:
+    # Whole-run aggregates of one stage's durations: count, sum, extremes and a
+    # histogram with BINS_PER_DECADE log-spaced bins from MIN_SECONDS up over
+    # DECADES decades (shorter and longer samples go to the first and last bin),
+    # so percentiles are within about 2% of the exact value at a fixed size.
+    __slots__ = ('count', 'total', 'min', 'max', 'hist')
+    MIN_SECONDS = 1e-7
+    DECADES = 9
+    BINS_PER_DECADE = 50
+    BINS = DECADES * BINS_PER_DECADE
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.hist = [0] * self.BINS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        if seconds > self.MIN_SECONDS:
+            i = min(int(math.log10(seconds / self.MIN_SECONDS) * self.BINS_PER_DECADE), self.BINS - 1)
+        else:
+            i = 0
+        self.hist[i] += 1
+
+    def percentile(self, q):
+        # Interpolated log-linearly within the bin holding the q-th percentile.
+        target = self.count * q / 100.0
+        cumulative = 0
+        for i, n in enumerate(self.hist):
+            if n and cumulative + n >= target:
+                fraction = (target - cumulative) / n
+                value = self.MIN_SECONDS * 10 ** ((i + fraction) / self.BINS_PER_DECADE)
+                return min(max(value, self.min), self.max)
+            cumulative += n
+        return self.max
+
+class Profiler:
+    # Per-run stage timings. Pipeline stages wrap their work in
+    # `with profiler.stage(name):` and the consumer calls tick() once per output
+    # frame. Memory stays constant however long the run: the live readout looks
+    # at the last `window` samples of each stage (kept exactly), and the final
+    # report is built from streaming per-stage totals with histogram
+    # percentiles. Safe to use from several threads at once.
+    def __init__(self, enabled=True, window=120):
+        self.enabled = enabled
+        self.window = window
+        self._recent = {}
+        self._totals = {}
+        self._ticks = deque(maxlen=window)
+        self._frames = 0
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def stage(self, name):
+        return _StageTimer(self, name) if self.enabled else _NULL_TIMER
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            recent = self._recent.get(name)
+            if recent is None:
+                recent = self._recent[name] = deque(maxlen=self.window)
+                self._totals[name] = _StageTotals()
+            recent.append(seconds)
+            self._totals[name].add(seconds)
+
+    def tick(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            self._ticks.append(now)
+            self._frames += 1
+
+    @property
+    def frames(self):
+        return self._frames
+
+    def fps(self):
+        # Rolling rate over the last `window` frames.
+        with self._lock:
+            ticks = list(self._ticks)
+        if len(ticks) < 2 or ticks[-1] <= ticks[0]:
+            return 0.0
+        return (len(ticks) - 1) / (ticks[-1] - ticks[0])
+
+    def stage_stats(self, last=None):
+        # {stage: {count, total, mean, p50, p95, p99, max}} in seconds, over the
+        # whole run, or exactly over the `last` (at most `window`) samples of each stage.
+        if last:
+            with self._lock:
+                samples = {name: list(values)[-last:] for name, values in self._recent.items()}
+            stats = {}
+            for name, values in samples.items():
+                values = np.asarray(values)
+                p50, p95, p99 = np.percentile(values, (50, 95, 99))
+                stats[name] = {
+                    'count': int(values.size),
+                    'total': float(values.sum()),
+                    'mean': float(values.mean()),
+                    'p50': float(p50),
+                    'p95': float(p95),
+                    'p99': float(p99),
+                    'max': float(values.max())
+                }
+            return stats
+        with self._lock:
+            totals = {name: (t.count, t.total, t.max, t.percentile(50), t.percentile(95), t.percentile(99))
+                      for name, t in self._totals.items()}
+        return {
+            name: {
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'p50': p50,
+                'p95': p95,
+                'p99': p99,
+                'max': high
+            }
+            for name, (count, total, high, p50, p95, p99) in totals.items()
+        }
+
+    def summary(self):
+        # One-line live readout: rolling fps and median latency per stage.
+        parts = [f"{self.fps():.1f} fps"]
+        for name, stats in self.stage_stats(self.window).items():
+            parts.append(f"{name} {stats['p50'] * 1000:.1f} ms")
+        return " | ".join(parts)
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'frames': self.frames,
+            'elapsed': elapsed,
+            'fps': self.frames / elapsed if elapsed > 0 else 0.0,
+            'stages': self.stage_stats()
+        }
+
+NULL_PROFILER = Profiler(enabled=False)
+
+REPORT_FIELDS = ('run', 'frames', 'elapsed_s', 'fps', 'stage', 'count', 'total_s',
+                 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+
+def write_report(reports, path):
+    # Writes {run name: Profiler.report()} as JSON, or as CSV (one row per run
+    # and stage) when the path ends in .csv.
+    if not path.lower().endswith('.csv'):
+        with open(path, 'w') as f:
+            json.dump(reports, f, indent=2)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(REPORT_FIELDS)
+        for run, report in reports.items():
+            for stage, stats in report['stages'].items():
+                writer.writerow([
+                    run, report['frames'], f"{report['elapsed']:.6f}", f"{report['fps']:.3f}", stage,
+                    stats['count'], f"{stats['total']:.6f}",
+                    *(f"{stats[key] * 1000:.4f}" for key in ('mean', 'p50', 'p95', 'p99', 'max'))
+                ])
\ No newline at end of file
@@ -0,0 +1,131 @@
+import csv
+import cv2
+import numpy as np
+
+NORMALIZE_MODES = ("Per Frame", "Global")
+
+# Direction sectors of 45 degrees centered on these compass points, in image
+# coordinates (y points down, so "S" is motion towards the bottom edge).
+DIRECTIONS = ('e', 'se', 's', 'sw', 'w', 'nw', 'n', 'ne')
+
+class FlowStatistics:
+    # Streaming magnitude statistics of a run's flow fields, updated one field at
+    # a time without keeping any of them:
+    # - running min, max and mean,
+    # - a fixed-bin histogram (HIST_MAX / BINS px wide bins up to HIST_MAX px,
+    #   plus one overflow bin) for approximate percentiles; histograms of
+    #   separate runs or chunks merge by addition,
+    # - one row per output: mean and max magnitude and the share of the total
+    #   magnitude moving in each of the eight DIRECTIONS.
+    # Row i describes output first_output + i. Fields are sampled on a grid of
+    # every SAMPLE_STEP-th pixel (directions on a grid twice as coarse), which
+    # keeps the cost around a tenth of computing the flow.
+    HIST_MAX = 256.0
+    BINS = 4096
+    SAMPLE_STEP = 2
+
+    def __init__(self, first_output=0):
+        self.first_output = first_output
+        self.pixels = 0
+        self.min = float('inf')
+        self.max = 0.0
+        self.total = 0.0
+        self.hist = np.zeros(self.BINS + 1, dtype=np.int64)
+        self.rows = []
+        self._mag = None
+        self._ang = None
+
+    @property
+    def mean(self):
+        return self.total / self.pixels if self.pixels else 0.0
+
+    def add(self, flow):
+        sample = flow[::self.SAMPLE_STEP, ::self.SAMPLE_STEP]
+        h, w = sample.shape[:2]
+        if self._mag is None or self._mag.shape != (h, w):
+            self._mag = np.empty((h, w), dtype=np.float32)
+            self._ang = np.empty((h, w), dtype=np.float32)
+        mag, ang = self._mag, self._ang
+        cv2.cartToPolar(sample[..., 0], sample[..., 1], magnitude=mag, angle=ang, angleInDegrees=True)
+        low, high, _, _ = cv2.minMaxLoc(mag)
+        total = float(cv2.sumElems(mag)[0])
+        counts = cv2.calcHist([mag], [0], None, [self.BINS], [0, self.HIST_MAX]).ravel()
+        self.hist[:-1] += counts.astype(np.int64)
+        self.hist[-1] += mag.size - int(counts.sum())
+        self.pixels += mag.size
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+        self.total += total
+        # Nearest 45 degree sector (8 wraps around to 0), weighted by magnitude.
+        sector = cv2.convertScaleAbs(ang[::2, ::2], alpha=1 / 45.0)
+        sector[sector == 8] = 0
+        weights = np.bincount(sector.ravel(), weights=mag[::2, ::2].ravel(), minlength=8)
+        weight_sum = weights.sum()
+        shares = weights / weight_sum if weight_sum > 0 else weights
+        self.rows.append((total / mag.size, high, *(float(share) for share in shares)))
+
+    def merge(self, other):
+        # Adds the statistics of `other`, whose outputs follow this one's.
+        self.pixels += other.pixels
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.total += other.total
+        self.hist += other.hist
+        self.rows.extend(other.rows)
+
+    def percentile(self, q):
+        # Approximate magnitude below which q percent of the sampled pixels lie,
+        # interpolated within a bin.
+        if self.pixels == 0:
+            return 0.0
+        if q <= 0:
+            return self.min
+        if q >= 100:
+            return self.max
+        target = self.pixels * q / 100.0
+        cumulative = np.cumsum(self.hist)
+        i = int(np.searchsorted(cumulative, target))
+        if i >= self.BINS:
+            return self.max
+        below = cumulative[i - 1] if i > 0 else 0
+        width = self.HIST_MAX / self.BINS
+        value = (i + (target - below) / self.hist[i]) * width
+        return float(min(max(value, self.min), self.max))
+
+    def magnitude_range(self, percentile=99.0):
+        # (low, high) for visualize_flow's mag_range: the smallest magnitude up to
+        # the given percentile, so a few outliers do not darken every frame.
+        low = self.min if self.pixels else 0.0
+        high = self.percentile(percentile)
+        return (low, high if high > low else low + 1e-6)
+
+    def to_dict(self):
+        # Global part only (the per-output rows are not kept), as stored with cache entries.
+        return {
+            'pixels': self.pixels,
+            'min': self.min if self.pixels else None,
+            'max': self.max,
+            'total': self.total,
+            'hist': self.hist.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.pixels = data['pixels']
+        stats.min = data['min'] if data['min'] is not None else float('inf')
+        stats.max = data['max']
+        stats.total = data['total']
+        stats.hist = np.asarray(data['hist'], dtype=np.int64)
+        return stats
+
+    def write_csv(self, path, frames=None):
+        # One row per output; `frames` optionally maps output index to the video
+        # frame the flow ends on.
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['output', 'frame', 'mean_mag', 'max_mag'] + [f"dir_{d}" for d in DIRECTIONS])
+            for i, row in enumerate(self.rows):
+                output = self.first_output + i
+                frame = frames[output] if frames is not None and output < len(frames) else ''
+                writer.writerow([output, frame] + [f"{value:.4f}" for value in row])
\ No newline at end of file
@@ -0,0 +1,249 @@
+from collections import OrderedDict
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import numpy as np
+
+class NpyWriter:
+    # Streams frames into a single (n, *shape) .npy file whose length is only
+    # known at the end: the header is written with room for any frame count and
+    # rewritten in place on close().
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.shape = None
+        self.dtype = None
+        self._header_len = None
+        self._file = open(path, 'wb')
+
+    def _header(self, count):
+        text = repr({
+            'descr': np.lib.format.dtype_to_descr(self.dtype),
+            'fortran_order': False,
+            'shape': (count,) + tuple(self.shape)
+        })
+        if self._header_len is None:
+            # Version 1.0 layout: 10 bytes of preamble, total padded to 64 bytes.
+            self._header_len = -(-(10 + len(text) + 1) // 64) * 64 - 10
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', self._header_len) + (text.ljust(self._header_len - 1) + '\n').encode('latin1')
+
+    def write(self, frame):
+        self.write_block(np.asarray(frame)[None])
+
+    def write_block(self, frames):
+        # Appends an (n, *shape) block of frames.
+        frames = np.asarray(frames)
+        if self.shape is None:
+            self.shape = frames.shape[1:]
+            self.dtype = frames.dtype
+            self._file.write(self._header(10 ** 15))
+        if frames.shape[1:] != self.shape or frames.dtype != self.dtype:
+            raise ValueError("Frame shape or dtype differs from the written frames")
+        self._file.write(np.ascontiguousarray(frames).data)
+        self.count += len(frames)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.shape is not None:
+            self._file.seek(0)
+            self._file.write(self._header(self.count))
+        self._file.close()
+
+    def abort(self):
+        # Closes and deletes the partly written file.
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class FrameStore:
+    # Append-only sequence of equally shaped frames spilled to disk as chunked
+    # .npy files. Only the chunk being written stays mapped for writing; finished
+    # chunks are flushed and reopened read-only on demand, so resident memory
+    # stays bounded by one chunk however many frames are stored. Reads return
+    # memmap views. With compress=True finished chunks are rewritten as
+    # compressed .npz files and loaded whole when read.
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory=None, chunk_bytes=128 << 20, compress=False):
+        self._owns_directory = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix='videoflow-')
+        os.makedirs(self.directory, exist_ok=True)
+        self.chunk_bytes = chunk_bytes
+        self.compress = compress
+        self.chunk_frames = None
+        self.shape = None
+        self.dtype = None
+        self.count = 0
+        self.metadata = {}
+        self._writer = None
+        self._writer_chunk = None
+        self._reader = (None, None)
+
+    @classmethod
+    def open(cls, directory):
+        # Reopens a store written with write_index(); the directory is left on disk at close().
+        with open(os.path.join(directory, cls.INDEX_FILE)) as f:
+            index = json.load(f)
+        store = cls(directory, compress=index['compress'])
+        store.chunk_frames = index['chunk_frames']
+        store.shape = tuple(index['shape']) if index['shape'] is not None else None
+        store.dtype = np.dtype(index['dtype']) if index['dtype'] is not None else None
+        store.count = index['count']
+        store.metadata = index.get('metadata', {})
+        return store
+
+    def _chunk_path(self, chunk, ext='.npy'):
+        return os.path.join(self.directory, f"chunk_{chunk:06d}{ext}")
+
+    def append(self, frame):
+        if self.shape is None:
+            self.shape, self.dtype = frame.shape, frame.dtype
+            self.chunk_frames = max(1, self.chunk_bytes // frame.nbytes)
+        elif frame.shape != self.shape or frame.dtype != self.dtype:
+            raise ValueError("Frame shape or dtype differs from the stored frames")
+        chunk, slot = divmod(self.count, self.chunk_frames)
+        if slot == 0:
+            self._finish_chunk()
+            self._writer = np.lib.format.open_memmap(
+                self._chunk_path(chunk), mode='w+', dtype=self.dtype,
+                shape=(self.chunk_frames,) + tuple(self.shape))
+            self._writer_chunk = chunk
+        elif self._writer is None:
+            # Appending to a store reopened (or indexed) mid-chunk.
+            if self.compress:
+                raise ValueError("Cannot append to a partially filled compressed chunk")
+            if self._reader[0] == chunk:
+                self._reader = (None, None)
+            self._writer = np.load(self._chunk_path(chunk), mmap_mode='r+')
+            self._writer_chunk = chunk
+        self._writer[slot] = frame
+        self.count += 1
+
+    def _finish_chunk(self):
+        if self._writer is None:
+            return
+        self._writer.flush()
+        self._writer = None
+        chunk = self._writer_chunk
+        if self.compress:
+            path = self._chunk_path(chunk)
+            frames = np.load(path, mmap_mode='r')
+            filled = min(self.chunk_frames, self.count - chunk * self.chunk_frames)
+            np.savez_compressed(self._chunk_path(chunk, '.npz'), frames=frames[:filled])
+            del frames
+            os.remove(path)
+        if self._reader[0] == chunk:
+            self._reader = (None, None)
+
+    def _chunk(self, chunk):
+        # One chunk's frames; the one being written is shared, others are opened read-only.
+        if self._writer is not None and chunk == self._writer_chunk:
+            return self._writer
+        if self._reader[0] != chunk:
+            compressed = self._chunk_path(chunk, '.npz')
+            if os.path.exists(compressed):
+                with np.load(compressed) as archive:
+                    frames = archive['frames']
+            else:
+                frames = np.load(self._chunk_path(chunk), mmap_mode='r')
+            self._reader = (chunk, frames)
+        return self._reader[1]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("Frame index out of range")
+        chunk, slot = divmod(i, self.chunk_frames)
+        return self._chunk(chunk)[slot]
+
+    def __iter__(self):
+        for block in self.iter_chunks():
+            yield from block
+
+    def iter_chunks(self):
+        # Consecutive (n, *shape) slices covering all stored frames.
+        if self.count == 0:
+            return
+        for chunk in range((self.count + self.chunk_frames - 1) // self.chunk_frames):
+            yield self._chunk(chunk)[:min(self.chunk_frames, self.count - chunk * self.chunk_frames)]
+
+    def nbytes(self):
+        # Size on disk.
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file())
+
+    def save_npy(self, path):
+        # Writes all frames as one (n, *shape) .npy, streaming chunk by chunk.
+        writer = NpyWriter(path)
+        try:
+            for block in self.iter_chunks():
+                writer.write_block(block)
+        finally:
+            writer.close()
+
+    def write_index(self, metadata=None):
+        # Finishes the open chunk and records the layout so open() can read the store back.
+        self._finish_chunk()
+        index = {
+            'count': self.count,
+            'shape': list(self.shape) if self.shape is not None else None,
+            'dtype': np.dtype(self.dtype).str if self.dtype is not None else None,
+            'chunk_frames': self.chunk_frames,
+            'compress': self.compress,
+            'metadata': metadata or {}
+        }
+        # Written aside and renamed, so a crash never leaves a torn index.
+        path = os.path.join(self.directory, self.INDEX_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        self._finish_chunk()
+        self._reader = (None, None)
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+class FrameCache:
+    # In-memory LRU of decoded frames by index, bounded by total bytes. Frames are
+    # kept by reference, so callers must not modify them after put().
+    def __init__(self, max_bytes=256 << 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, index):
+        with self._lock:
+            frame = self._frames.get(index)
+            if frame is not None:
+                self._frames.move_to_end(index)
+            return frame
+
+    def put(self, index, frame):
+        if frame.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._frames.pop(index, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._frames[index] = frame
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
\ No newline at end of file
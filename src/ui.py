@@ -1,19 +1,26 @@
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout,
-    QPushButton, QLabel, QSlider, QSpinBox, QComboBox, QCheckBox,
+    QPushButton, QLabel, QSlider, QSpinBox, QDoubleSpinBox, QComboBox, QCheckBox,
     QProgressBar, QSplitter, QFileDialog, QGroupBox, QMessageBox,
     QStatusBar, QInputDialog
 )
 from PySide6.QtGui import QDragEnterEvent, QDropEvent, QImage, QPixmap
 from PySide6.QtCore import Qt, QTimer, Signal
-import cv2
-import numpy as np
+import importlib
 import os
-from src.worker import VideoLoaderThread, FlowProcessorThread
-from src.utils import get_video_metadata, visualize_flow
+import threading
+import time
+
+# cv2, NumPy and the processing modules take about as long to import as Qt
+# itself. They are imported on a background thread while the window comes up
+# (see import_stack), and methods import the names they use locally.
+STACK_MODULES = ('src.checkpoint', 'src.export', 'src.worker')
+
+LIVE_CACHE_BYTES = 4 << 30  # raw results kept on disk for live re-rendering
 
 class MainUI(QMainWindow):
-    frame_ready = Signal(np.ndarray)  # For preview updates
+    frame_ready = Signal(object)  # For preview updates
+    stack_ready = Signal()
 
     def __init__(self):
         super().__init__()
@@ -27,7 +34,35 @@ class MainUI(QMainWindow):
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_preview)
         self.thread = None
-        self.processed_viz = []
+        self.loader_thread = None
+        self.index_thread = None
+        self.frame_index = None
+        # Scrubbing: recently decoded frames, a thumbnail per stretch of the video
+        # and a thread decoding the exact frames asked for.
+        self.frame_cache = None  # Created with the first video.
+        self.thumbnails = None
+        self.thumbnail_thread = None
+        self.frame_fetcher = None
+        self.seek_target = None
+        self.seek_position = None
+        self.result_store = None
+        self.checkpoints = None
+        self.run_interrupted = False
+        self.export_thread = None
+        self.export_interrupted = False
+        self.flow_cache = None
+        # Live re-render: raw results of the last run and the output shown in the
+        # flow preview, re-rendered when a display-only parameter changes.
+        self.raw_store = None
+        self.raw_statistics = None
+        self.visible_output = None
+        self.last_statistics = None
+        self.render_timer = QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(250)
+        self.render_timer.timeout.connect(self.rerender_results)
+        self.last_params = None
+        self.last_report = {}
 
         # Central widget and layout
         central_widget = QWidget()
@@ -71,6 +106,10 @@ class MainUI(QMainWindow):
         frame_layout.addWidget(QLabel("Frame Step:"), 3, 0)
         self.step_spin = QSpinBox(value=1, minimum=1)
         frame_layout.addWidget(self.step_spin, 3, 1)
+        frame_layout.addWidget(QLabel("Workers:"), 4, 0)
+        self.workers_spin = QSpinBox(value=1, minimum=1, maximum=os.cpu_count() or 1)
+        self.workers_spin.setToolTip("Process overlapping frame chunks in parallel (ignored with warm start)")
+        frame_layout.addWidget(self.workers_spin, 4, 1)
         left_panel.addWidget(self.frame_group)
         main_layout.addLayout(left_panel)
 
@@ -81,7 +120,6 @@ class MainUI(QMainWindow):
         self.algo_label = QLabel("Algorithm:")
         param_layout.addWidget(self.algo_label, 0, 0)
         self.algo_combo = QComboBox()
-        self.algo_combo.addItems(["Farneback", "Dense Optical Flow", "FlowTrace"])
         param_layout.addWidget(self.algo_combo, 0, 1)
         self.algo_combo.currentTextChanged.connect(self.update_params_visibility)
         # Placeholder for dynamic params (use QStackedWidget in future)
@@ -103,25 +141,64 @@ class MainUI(QMainWindow):
         self.mag_slider.setRange(0, 100)
         self.mag_slider.setValue(0)
         param_layout.addWidget(self.mag_slider, 4, 1)
+        self.norm_label = QLabel("Normalization:")
+        param_layout.addWidget(self.norm_label, 5, 0)
+        self.norm_combo = QComboBox()
+        self.norm_combo.setToolTip("Scale brightness per frame, or by the whole run's magnitude percentiles so frames compare")
+        param_layout.addWidget(self.norm_combo, 5, 1)
         self.cmap_label = QLabel("Color Map:")
-        param_layout.addWidget(self.cmap_label, 5, 0)
+        param_layout.addWidget(self.cmap_label, 6, 0)
         self.cmap_combo = QComboBox()
         self.cmap_combo.addItems(["hsv", "jet", "viridis", "grayscale"])
-        param_layout.addWidget(self.cmap_combo, 5, 1)
+        param_layout.addWidget(self.cmap_combo, 6, 1)
         self.arrow_density_label = QLabel("Arrow Density:")
-        param_layout.addWidget(self.arrow_density_label, 6, 0)
+        param_layout.addWidget(self.arrow_density_label, 7, 0)
         self.arrow_density_spin = QSpinBox(value=16, minimum=1)
-        param_layout.addWidget(self.arrow_density_spin, 6, 1)
+        param_layout.addWidget(self.arrow_density_spin, 7, 1)
         self.arrow_size_label = QLabel("Arrow Size:")
-        param_layout.addWidget(self.arrow_size_label, 7, 0)
+        param_layout.addWidget(self.arrow_size_label, 8, 0)
         self.arrow_size_spin = QSpinBox(value=1, minimum=1)
-        param_layout.addWidget(self.arrow_size_spin, 7, 1)
+        param_layout.addWidget(self.arrow_size_spin, 8, 1)
         self.invert_check = QCheckBox("Invert Frames (for dark tracers)")
-        param_layout.addWidget(self.invert_check, 8, 0, 1, 2)
+        param_layout.addWidget(self.invert_check, 9, 0, 1, 2)
         self.bg_subtract_check = QCheckBox("Subtract Background")
-        param_layout.addWidget(self.bg_subtract_check, 9, 0, 1, 2)
+        param_layout.addWidget(self.bg_subtract_check, 10, 0, 1, 2)
+        self.trace_compact_check = QCheckBox("Compact Memory (slower; long traces on large frames)")
+        self.trace_compact_check.setToolTip("Keep only the trace window's frames in memory instead of per-pixel histograms")
+        param_layout.addWidget(self.trace_compact_check, 11, 0, 1, 2)
         self.smooth_check = QCheckBox("Apply Smoothing")
-        param_layout.addWidget(self.smooth_check, 10, 0, 1, 2)
+        param_layout.addWidget(self.smooth_check, 12, 0, 1, 2)
+        self.warm_start_check = QCheckBox("Warm Start (reuse previous flow)")
+        param_layout.addWidget(self.warm_start_check, 13, 0, 1, 2)
+        self.cache_check = QCheckBox("Cache Raw Results (live re-render without recomputing)")
+        param_layout.addWidget(self.cache_check, 14, 0, 1, 2)
+        self.flow_mode_label = QLabel("Flow Mode:")
+        param_layout.addWidget(self.flow_mode_label, 15, 0)
+        self.flow_mode_combo = QComboBox()
+        self.flow_mode_combo.setToolTip("Full frame, downscaled (Coarse) or split into overlapping tiles (Tiled)")
+        self.flow_mode_combo.currentTextChanged.connect(lambda _: self.update_params_visibility(self.algo_combo.currentText()))
+        param_layout.addWidget(self.flow_mode_combo, 15, 1)
+        self.flow_scale_label = QLabel("Coarse Scale:")
+        param_layout.addWidget(self.flow_scale_label, 16, 0)
+        self.flow_scale_spin = QDoubleSpinBox(value=0.5, minimum=0.05, maximum=1.0, singleStep=0.05)
+        param_layout.addWidget(self.flow_scale_spin, 16, 1)
+        self.tile_size_label = QLabel("Tile Size:")
+        param_layout.addWidget(self.tile_size_label, 17, 0)
+        self.tile_size_spin = QSpinBox(value=512, minimum=64, maximum=8192, singleStep=64)
+        param_layout.addWidget(self.tile_size_spin, 17, 1)
+        self.tile_overlap_label = QLabel("Tile Overlap:")
+        param_layout.addWidget(self.tile_overlap_label, 18, 0)
+        self.tile_overlap_spin = QSpinBox(value=32, minimum=0, maximum=1024)
+        param_layout.addWidget(self.tile_overlap_spin, 18, 1)
+        self.roi_check = QCheckBox("Region of Interest (x, y, width, height)")
+        self.roi_check.toggled.connect(self.toggle_roi)
+        param_layout.addWidget(self.roi_check, 19, 0, 1, 2)
+        roi_layout = QHBoxLayout()
+        self.roi_spins = [QSpinBox(minimum=0, maximum=0) for _ in range(4)]
+        for spin in self.roi_spins:
+            spin.setEnabled(False)
+            roi_layout.addWidget(spin)
+        param_layout.addLayout(roi_layout, 20, 0, 1, 2)
         right_splitter.addWidget(self.param_group)
 
         self.output_group = QGroupBox("Output")
@@ -138,9 +215,16 @@ class MainUI(QMainWindow):
         self.process_button = QPushButton("Process")
         self.process_button.clicked.connect(self.start_processing)
         controls_layout.addWidget(self.process_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_processing)
+        controls_layout.addWidget(self.cancel_button)
         self.export_button = QPushButton("Export")
         self.export_button.clicked.connect(self.export_results)
         controls_layout.addWidget(self.export_button)
+        self.encode_check = QCheckBox("Encode MP4 While Processing")
+        self.encode_check.setToolTip("Ask for an output file and encode each result as soon as it is computed")
+        controls_layout.addWidget(self.encode_check)
         output_layout.addLayout(controls_layout)
         self.progress_bar = QProgressBar()
         output_layout.addWidget(self.progress_bar)
@@ -154,9 +238,42 @@ class MainUI(QMainWindow):
         # Enable drag-drop on window
         self.setAcceptDrops(True)
 
+        # Display-only parameters re-render cached results as they change.
+        self.mag_slider.valueChanged.connect(self.display_params_changed)
+        self.norm_combo.currentTextChanged.connect(self.display_params_changed)
+        self.cmap_combo.currentTextChanged.connect(self.display_params_changed)
+        self.arrow_density_spin.valueChanged.connect(self.display_params_changed)
+        self.arrow_size_spin.valueChanged.connect(self.display_params_changed)
+        self.smooth_check.toggled.connect(self.display_params_changed)
+
         # Initial visibility
         self.update_params_visibility(self.algo_combo.currentText())
 
+        # Choices that come from the processing modules are filled in, and
+        # processing enabled, once those are imported.
+        self.process_button.setEnabled(False)
+        self.stack_ready.connect(self.finish_startup)
+        # Started from the event loop, so the window is painted first.
+        QTimer.singleShot(0, lambda: threading.Thread(target=self.import_stack, name='import_stack', daemon=True).start())
+
+    def import_stack(self):
+        # Imported only to load them (worker pulls in cv2, NumPy and the
+        # pipeline); the methods that use them import the names they need.
+        try:
+            for module in STACK_MODULES:
+                importlib.import_module(module)
+        finally:
+            # finish_startup() repeats the imports, so a failure shows up there.
+            self.stack_ready.emit()
+
+    def finish_startup(self):
+        from src.processors import FLOW_ALGORITHMS, FLOW_MODES
+        from src.stats import NORMALIZE_MODES
+        self.algo_combo.addItems(list(FLOW_ALGORITHMS) + ["FlowTrace"])
+        self.flow_mode_combo.addItems(list(FLOW_MODES))
+        self.norm_combo.addItems(list(NORMALIZE_MODES))
+        self.process_button.setEnabled(True)
+
     def update_params_visibility(self, algo):
         is_flowtrace = (algo == "FlowTrace")
         self.win_size_label.setText("Trace Length:" if is_flowtrace else "Window Size:")
@@ -166,13 +283,28 @@ class MainUI(QMainWindow):
         self.iter_spin.setVisible(not is_flowtrace)
         self.mag_label.setVisible(not is_flowtrace)
         self.mag_slider.setVisible(not is_flowtrace)
+        self.norm_label.setVisible(not is_flowtrace)
+        self.norm_combo.setVisible(not is_flowtrace)
         self.arrow_density_label.setVisible(not is_flowtrace)
         self.arrow_density_spin.setVisible(not is_flowtrace)
         self.arrow_size_label.setVisible(not is_flowtrace)
         self.arrow_size_spin.setVisible(not is_flowtrace)
         self.invert_check.setVisible(is_flowtrace)
         self.bg_subtract_check.setVisible(is_flowtrace)
-        # cmap and smooth are shared
+        self.trace_compact_check.setVisible(is_flowtrace)
+        self.warm_start_check.setVisible(not is_flowtrace)
+        mode = self.flow_mode_combo.currentText()
+        self.flow_mode_label.setVisible(not is_flowtrace)
+        self.flow_mode_combo.setVisible(not is_flowtrace)
+        for widget in (self.flow_scale_label, self.flow_scale_spin):
+            widget.setVisible(not is_flowtrace and mode == "Coarse")
+        for widget in (self.tile_size_label, self.tile_size_spin, self.tile_overlap_label, self.tile_overlap_spin):
+            widget.setVisible(not is_flowtrace and mode == "Tiled")
+        # cmap, smooth and the region of interest are shared
+
+    def toggle_roi(self, checked):
+        for spin in self.roi_spins:
+            spin.setEnabled(checked)
 
     def dragEnterEvent(self, event: QDragEnterEvent):
         if event.mimeData().hasUrls():
@@ -186,25 +318,112 @@ class MainUI(QMainWindow):
             self.load_video(files[0])
 
     def load_video(self, path=None):
+        if self.export_thread and self.export_thread.isRunning():
+            # The export reads results that a new video would release.
+            self.status_bar.showMessage("Wait for the export to finish (or cancel it) before loading another video")
+            return
         if not path:
             path, _ = QFileDialog.getOpenFileName(self, "Select Video", "", "Videos (*.mp4 *.avi *.mov *.mkv)")
         if path:
-            self.video_path = path
-            try:
-                self.metadata = get_video_metadata(path)
-                self.metadata_label.setText(
-                    f"Resolution: {self.metadata['resolution']} | FPS: {self.metadata['fps']} | "
-                    f"Duration: {self.metadata['duration']:.2f}s | Codec: {self.metadata['codec']}"
-                )
-                self.cap = cv2.VideoCapture(path, cv2.CAP_MSMF)
-                self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                self.start_spin.setRange(0, self.total_frames - 1)
-                self.end_spin.setRange(0, self.total_frames - 1)
+            from src.worker import VideoLoaderThread
+            # Probing and opening the capture happen off the GUI thread;
+            # video_loaded() takes over once they are done. A probe still running
+            # for a previous pick is finished first and its result dropped.
+            if self.loader_thread is not None:
+                self.loader_thread.wait()
+            self.loader_thread = VideoLoaderThread(path)
+            self.loader_thread.loaded.connect(self.video_loaded)
+            self.loader_thread.error.connect(self.video_load_failed)
+            self.loader_thread.start()
+            self.status_bar.showMessage(f"Loading {os.path.basename(path)}...")
+
+    def video_loaded(self, metadata, cap, frame):
+        if self.sender() is not self.loader_thread:
+            cap.release()  # Superseded by a later load.
+            return
+        from src.storage import FrameCache
+        from src.worker import FrameFetcher, FrameIndexThread
+        # An export started while this video was loading still reads the old results.
+        self.stop_export()
+        path = self.loader_thread.video_path
+        self.video_path = path
+        self.metadata = metadata
+        self.metadata_label.setText(
+            f"Resolution: {self.metadata['resolution']} | FPS: {self.metadata['fps']} | "
+            f"Duration: {self.metadata['duration']:.2f}s | Codec: {self.metadata['codec']}"
+        )
+        self.stop_scrubbing()
+        self.render_timer.stop()
+        self.close_raw_store()  # Results of the previous video are no longer live.
+        if self.cap is not None:
+            self.cap.release()
+        self.cap = cap
+        if self.frame_cache is None:
+            self.frame_cache = FrameCache()
+        self.total_frames = self.metadata['frame_count']
+        self.start_spin.setRange(0, self.total_frames - 1)
+        self.end_spin.setRange(0, self.total_frames - 1)
+        self.end_spin.setValue(self.total_frames - 1)
+        self.seek_slider.setRange(0, self.total_frames - 1)
+        width, height = self.metadata['resolution']
+        # x, y, width, height; defaults to the whole frame.
+        for spin, low, high in zip(self.roi_spins, (0, 0, 1, 1), (width - 1, height - 1, width, height)):
+            spin.setRange(low, high)
+            spin.setValue(0 if low == 0 else high)
+        if frame is not None:
+            self.current_frame = frame
+            self.frame_cache.put(0, frame)
+            self.display_image(frame, self.preview_label)
+            self.seek_slider.setValue(0)
+        self.frame_fetcher = FrameFetcher(path, self.frame_cache)
+        self.frame_fetcher.frame_ready.connect(self.scrub_frame_ready)
+        self.frame_fetcher.start()
+        # Exact frame count and keyframe positions for stepping and seeking.
+        self.frame_index = None
+        self.index_thread = FrameIndexThread(path)
+        self.index_thread.index_ready.connect(self.frame_index_ready)
+        self.index_thread.start()
+        self.status_bar.showMessage(f"Loaded {os.path.basename(path)}")
+
+    def video_load_failed(self, msg):
+        if self.sender() is not self.loader_thread:
+            return
+        self.status_bar.clearMessage()
+        QMessageBox.warning(self, "Error", f"Failed to load video: {msg}")
+
+    def frame_index_ready(self, index):
+        if self.sender() is not self.index_thread:
+            return  # Index of a previously loaded video.
+        self.frame_index = index
+        if self.frame_fetcher is not None:
+            self.frame_fetcher.set_frame_index(index)
+        if index['frame_count'] > 0 and index['frame_count'] != self.total_frames:
+            self.total_frames = index['frame_count']
+            self.start_spin.setRange(0, self.total_frames - 1)
+            self.end_spin.setRange(0, self.total_frames - 1)
+            self.seek_slider.setRange(0, self.total_frames - 1)
+            if self.entire_check.isChecked():
                 self.end_spin.setValue(self.total_frames - 1)
-                self.seek_slider.setRange(0, self.total_frames - 1)
-                self.update_preview()
-            except Exception as e:
-                QMessageBox.warning(self, "Error", f"Failed to load video: {str(e)}")
+        # Thumbnails once the frame count is exact and keyframes are known to seek with.
+        from src.pipeline import ThumbnailIndex
+        from src.worker import ThumbnailThread
+        self.thumbnails = ThumbnailIndex()
+        self.thumbnail_thread = ThumbnailThread(self.video_path, self.thumbnails, self.total_frames, index)
+        self.thumbnail_thread.start()
+
+    def stop_scrubbing(self):
+        if self.thumbnail_thread is not None:
+            self.thumbnail_thread.cancel()
+            self.thumbnail_thread.wait()
+            self.thumbnail_thread = None
+        if self.frame_fetcher is not None:
+            self.frame_fetcher.stop()
+            self.frame_fetcher = None
+        self.thumbnails = None
+        if self.frame_cache is not None:
+            self.frame_cache.clear()
+        self.seek_target = None
+        self.seek_position = None
 
     def toggle_playback(self):
         if self.timer.isActive():
@@ -216,9 +435,15 @@ class MainUI(QMainWindow):
 
     def update_preview(self):
         if self.cap:
+            import cv2
+            if self.seek_position is not None:
+                # Playback continues from the last scrubbed position.
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.seek_position)
+                self.seek_position = None
             ret, frame = self.cap.read()
             if ret:
                 self.current_frame = frame
+                self.frame_cache.put(int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1, frame)
                 self.display_image(frame, self.preview_label)
                 self.seek_slider.setValue(int(self.cap.get(cv2.CAP_PROP_POS_FRAMES)))
             else:
@@ -226,9 +451,35 @@ class MainUI(QMainWindow):
                 self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
     def seek_video(self, position):
-        if self.cap:
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, position)
-            self.update_preview()
+        # Shows a cached frame right away; otherwise the nearest thumbnail until
+        # the fetcher has decoded the exact frame. The playback capture is only
+        # moved when playback resumes, since seeking it on every slider step is
+        # what made scrubbing slow.
+        if not self.cap:
+            return
+        self.seek_position = position
+        frame = self.frame_cache.get(position)
+        if frame is not None:
+            self.seek_target = None
+            self.current_frame = frame
+            self.display_image(frame, self.preview_label)
+            self.show_output_at(position)
+            return
+        nearest = self.thumbnails.nearest(position) if self.thumbnails is not None else None
+        if nearest is not None:
+            self.display_preview(nearest[1], self.preview_label)
+        self.seek_target = position
+        if self.frame_fetcher is not None:
+            self.frame_fetcher.request(position)
+        self.show_output_at(position)
+
+    def scrub_frame_ready(self, index, frame):
+        # Stale results (the slider has moved on, or another video was loaded) are ignored.
+        if self.sender() is not self.frame_fetcher or index != self.seek_target:
+            return
+        self.seek_target = None
+        self.current_frame = frame
+        self.display_image(frame, self.preview_label)
 
     def toggle_entire(self, state):
         self.start_spin.setEnabled(not state)
@@ -237,17 +488,14 @@ class MainUI(QMainWindow):
             self.start_spin.setValue(0)
             self.end_spin.setValue(self.total_frames - 1)
 
-    def start_processing(self):
-        if not self.video_path:
-            QMessageBox.warning(self, "Error", "No video loaded")
-            return
-        self.processed_viz = []
-        params = {
+    def current_params(self):
+        return {
             'algorithm': self.algo_combo.currentText(),
             'win_size': self.win_size_spin.value(),
             'pyr_levels': self.pyr_levels_spin.value(),
             'iterations': self.iter_spin.value(),
             'mag_threshold': self.mag_slider.value() / 100.0,
+            'normalize': self.norm_combo.currentText(),
             'cmap': self.cmap_combo.currentText(),
             'arrow_density': self.arrow_density_spin.value(),
             'arrow_size': self.arrow_size_spin.value(),
@@ -255,73 +503,367 @@ class MainUI(QMainWindow):
             'start_frame': self.start_spin.value(),
             'end_frame': self.end_spin.value(),
             'step': self.step_spin.value(),
+            'workers': self.workers_spin.value(),
+            'frame_index': self.frame_index,
             'invert': self.invert_check.isChecked(),
-            'bg_subtract': self.bg_subtract_check.isChecked()
+            'bg_subtract': self.bg_subtract_check.isChecked(),
+            'trace_compact': self.trace_compact_check.isChecked(),
+            'warm_start': self.warm_start_check.isChecked(),
+            'flow_mode': self.flow_mode_combo.currentText(),
+            'flow_scale': self.flow_scale_spin.value(),
+            'tile_size': self.tile_size_spin.value(),
+            'tile_overlap': self.tile_overlap_spin.value(),
+            'roi': tuple(spin.value() for spin in self.roi_spins) if self.roi_check.isChecked() else None
         }
-        self.thread = FlowProcessorThread(self.video_path, params)
+
+    def start_processing(self):
+        if not self.video_path:
+            QMessageBox.warning(self, "Error", "No video loaded")
+            return
+        from src.cache import FlowCache
+        from src.checkpoint import Checkpoints
+        from src.export import VideoSink
+        from src.worker import FlowProcessorThread
+        params = self.current_params()
+        sink = None
+        if self.encode_check.isChecked():
+            path, _ = QFileDialog.getSaveFileName(self, "Encode Video To", "", "Videos (*.mp4)")
+            if not path:
+                return
+            if not path.endswith('.mp4'):
+                path += '.mp4'
+            sink = VideoSink(path, self.metadata.get('fps', 30))
+        self.render_timer.stop()
+        self.stop_rerender()
+        self.close_raw_store()
+        if self.cache_check.isChecked() and self.flow_cache is None:
+            self.flow_cache = FlowCache(max_bytes=LIVE_CACHE_BYTES)
+        # Results stream to disk from the worker thread; only previews pass through
+        # here. The store is checkpointed, so an interrupted run with the same
+        # settings picks up where it stopped.
+        if self.checkpoints is None:
+            self.checkpoints = Checkpoints()
+        if self.result_store is not None:
+            self.checkpoints.release(self.result_store)
+        self.result_store = self.checkpoints.open(self.video_path, params)
+        self.last_params = params
+        cache = self.flow_cache if self.cache_check.isChecked() else None
+        preview_size = (self.flow_preview.width(), self.flow_preview.height())
+        self.thread = FlowProcessorThread(self.video_path, params, self.result_store, cache, preview_size, checkpoints=self.checkpoints, sink=sink)
         self.thread.progress.connect(self.progress_bar.setValue)
-        self.thread.frame_ready.connect(self.update_flow_preview)
+        self.thread.preview_ready.connect(self.update_flow_preview)
         self.thread.finished.connect(self.processing_finished)
         self.thread.error.connect(self.handle_error)
+        self.thread.stats.connect(self.update_stats)
+        self.thread.cancelled.connect(self.processing_cancelled)
+        self.run_interrupted = False
         self.thread.start()
-        self.status_bar.showMessage("Processing...")
+        self.export_button.setEnabled(False)
+        self.process_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        if self.thread.first_output > 0:
+            self.status_bar.showMessage(f"Resuming after {self.thread.first_output} completed frames...")
+        else:
+            self.status_bar.showMessage("Processing...")
 
-    def update_flow_preview(self, original, flow_viz):
-        self.display_image(original, self.original_preview)
-        self.display_image(flow_viz, self.flow_preview)
-        self.processed_viz.append(flow_viz.copy())
+    def cancel_processing(self):
+        if self.export_thread and self.export_thread.isRunning():
+            self.export_thread.cancel()
+            self.cancel_button.setEnabled(False)
+            self.status_bar.showMessage("Cancelling export...")
+        elif self.thread and self.thread.isRunning():
+            self.thread.cancel()
+            self.cancel_button.setEnabled(False)
+            self.status_bar.showMessage("Cancelling...")
+
+    def update_flow_preview(self):
+        if self.sender() is not self.thread:
+            return  # Queued by a run that has since been replaced.
+        item = self.thread.preview.take()
+        if item is None:
+            return
+        with self.thread.profiler.stage('preview'):
+            self.display_preview(item[0], self.original_preview)
+            self.display_preview(item[1], self.flow_preview)
+
+    def update_stats(self, summary):
+        self.status_bar.showMessage(f"Processing... {summary}")
 
     def processing_finished(self):
-        self.status_bar.showMessage("Processing complete")
+        from src.checkpoint import display_params
+        from src.profiling import write_report
+        if self.sender() is not self.thread:
+            return  # A run that has since been replaced.
+        self.export_button.setEnabled(True)
+        self.process_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        # Each run leaves a machine-readable profile next to the application log.
+        self.last_report = {self.video_path: self.thread.profiler.report()}
+        os.makedirs('logs', exist_ok=True)
+        write_report(self.last_report, os.path.join('logs', time.strftime('profile-%Y%m%d-%H%M%S.json')))
+        if not self.run_interrupted:
+            encoded = f"; video saved to {self.thread.sink.path}" if self.thread.sink is not None else ""
+            self.status_bar.showMessage(f"Processing complete: {self.thread.profiler.summary()}{encoded}")
+            self.visible_output = len(self.result_store) - 1
+            self.last_statistics = self.thread.statistics
+            # A resumed run leaves no complete cache entry, so it has nothing to re-render from.
+            if self.thread.cache is not None:
+                self.raw_store = self.thread.cache.lookup(self.video_path, self.last_params)
+            # frame_index and the like often arrive mid-run and need no re-render.
+            if self.raw_store is not None and display_params(self.current_params()) != display_params(self.last_params):
+                self.display_params_changed()  # Changed while processing.
+
+    def close_raw_store(self):
+        if self.raw_store is not None:
+            self.raw_store.close()
+            self.raw_store = None
+        self.raw_statistics = None
+        self.visible_output = None
+
+    def output_at(self, position):
+        # Index of the result computed for video frame `position`, if there is one.
+        from src.pipeline import frame_context
+        if self.visible_output is None or self.result_store is None:
+            return None
+        offset = position - self.last_params['start_frame']
+        if offset < 0 or offset % self.last_params['step']:
+            return None
+        output = offset // self.last_params['step'] - frame_context(self.last_params)
+        count = len(self.raw_store) if self.raw_store is not None else len(self.result_store)
+        return output if 0 <= output < count else None
+
+    def show_output_at(self, position):
+        # Scrubbing over the processed range also shows the matching result.
+        output = self.output_at(position)
+        if output is None or (self.thread and self.thread.isRunning() and self.raw_store is None):
+            return
+        self.visible_output = output
+        self.show_visible_output()
+
+    def show_visible_output(self):
+        # Stored results are only read while no worker is appending to them;
+        # otherwise the output is rendered from the raw results.
+        from src.pipeline import render_result
+        if (self.thread and self.thread.isRunning()) or self.visible_output >= len(self.result_store):
+            viz = render_result(self.raw_store[self.visible_output], self.render_params(self.last_params))
+        else:
+            viz = self.result_store[self.visible_output]
+        self.display_image(viz, self.flow_preview)
+
+    def display_params_changed(self, *_):
+        # Live re-render: the visible output is redrawn right away from the cached
+        # raw results; the whole range follows in the background once the
+        # controls have been still for a moment. Compute parameters need a new run.
+        from src.cache import compute_params
+        from src.pipeline import render_result
+        from src.worker import RenderThread
+        if self.visible_output is None:
+            return
+        if self.raw_store is None:
+            self.status_bar.showMessage("Enable \"Cache Raw Results\" and process again to re-render without recomputing")
+            return
+        if self.thread and self.thread.isRunning() and not isinstance(self.thread, RenderThread):
+            return  # The running job keeps the parameters it started with.
+        params = self.current_params()
+        if compute_params(params) != compute_params(self.last_params):
+            self.status_bar.showMessage("Computation parameters changed; press Process to recompute")
+            return
+        self.stop_rerender()
+        self.last_params = params
+        self.display_image(render_result(self.raw_store[self.visible_output], self.render_params(params)), self.flow_preview)
+        self.render_timer.start()
+
+    def render_params(self, params):
+        # Global normalization takes its range from the cached run's statistics.
+        from src.pipeline import global_params, needs_global_range, stored_statistics
+        if not needs_global_range(params):
+            return params
+        if self.raw_statistics is None:
+            self.raw_statistics = stored_statistics(self.raw_store)
+        return global_params(params, self.raw_statistics)
+
+    def stop_rerender(self):
+        # A half-finished re-render is cheaper to redo than to keep as a checkpoint.
+        from src.worker import RenderThread
+        if isinstance(self.thread, RenderThread) and self.thread.isRunning():
+            self.thread.blockSignals(True)
+            self.thread.cancel()
+            self.thread.wait()
+            self.checkpoints.discard(self.result_store)
+            self.result_store = None
+            # Its finished signal is blocked, so rerender_finished never runs.
+            self.process_button.setEnabled(True)
+
+    def rerender_results(self):
+        from src.worker import RenderThread
+        if self.raw_store is None:
+            return
+        if self.export_thread and self.export_thread.isRunning():
+            self.render_timer.start()  # The export reads the current results; retry once it is done.
+            return
+        self.stop_rerender()
+        if self.result_store is not None:
+            self.checkpoints.release(self.result_store)
+        self.result_store = self.checkpoints.open(self.video_path, self.last_params)
+        self.thread = RenderThread(self.video_path, self.render_params(self.last_params), self.raw_store.directory, self.result_store, self.checkpoints)
+        self.thread.progress.connect(self.progress_bar.setValue)
+        self.thread.finished.connect(self.rerender_finished)
+        self.thread.error.connect(self.handle_error)
+        self.thread.cancelled.connect(self.processing_cancelled)
+        self.run_interrupted = False
+        self.thread.start()
+        # Process would reopen (and may wipe) the store this thread is writing.
+        self.export_button.setEnabled(False)
+        self.process_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.status_bar.showMessage("Re-rendering...")
+
+    def rerender_finished(self):
+        if self.sender() is not self.thread:
+            return  # A re-render that has since been replaced.
+        self.export_button.setEnabled(True)
+        self.process_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        if not self.run_interrupted:
+            self.status_bar.showMessage(f"Re-render complete: {self.thread.profiler.summary()}")
+
+    def processing_cancelled(self):
+        self.run_interrupted = True
+        self.status_bar.showMessage(f"Processing cancelled after {len(self.result_store)} frames; process again with the same settings to resume")
 
     def handle_error(self, msg):
+        self.run_interrupted = True
         QMessageBox.warning(self, "Error", msg)
         self.status_bar.showMessage("Processing failed")
 
+    def closeEvent(self, event):
+        # Stop a running worker (it checkpoints on the way out) before letting go of its store.
+        self.render_timer.stop()
+        if self.loader_thread is not None:
+            self.loader_thread.wait()
+        self.stop_export()
+        if self.thread and self.thread.isRunning():
+            self.thread.cancel()
+            self.thread.wait()
+        if self.result_store is not None:
+            self.checkpoints.release(self.result_store)
+            self.result_store = None
+        self.close_raw_store()
+        self.stop_scrubbing()
+        super().closeEvent(event)
+
     def export_results(self):
-        if not self.processed_viz:
+        from src.export import IMAGE_FORMATS, ImageSink, VideoSink
+        from src.pipeline import output_frames
+        from src.profiling import write_report
+        from src.storage import NpyWriter
+        if self.result_store is None or len(self.result_store) == 0:
             QMessageBox.warning(self, "Error", "No processed results to export")
             return
-        export_type, ok = QInputDialog.getItem(self, "Export Type", "Select format:", ["Video (MP4)", "Image Sequence", "Numpy Array"], 0, False)
+        export_type, ok = QInputDialog.getItem(self, "Export Type", "Select format:", ["Video (MP4)", "Image Sequence (PNG)", "Image Sequence (JPEG)", "Numpy Array", "Raw Flow (NumPy)", "Flow Statistics (CSV)", "Profiling Report"], 0, False)
         if not ok:
             return
+        # Frame exports run in the background from the finished store on disk.
         if export_type == "Video (MP4)":
             path, _ = QFileDialog.getSaveFileName(self, "Save Video", "", "Videos (*.mp4)")
             if path:
                 if not path.endswith('.mp4'):
                     path += '.mp4'
-                height, width = self.processed_viz[0].shape[:2]
-                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-                fps = self.metadata.get('fps', 30)
-                out = cv2.VideoWriter(path, fourcc, fps, (width, height))
-                for viz in self.processed_viz:
-                    out.write(viz)
-                out.release()
-                QMessageBox.information(self, "Success", "Video exported successfully")
-        elif export_type == "Image Sequence":
+                self.start_export(self.result_store.directory, VideoSink(path, self.metadata.get('fps', 30)), "Video exported successfully")
+        elif export_type.startswith("Image Sequence"):
+            ext = 'png' if export_type.endswith("(PNG)") else 'jpg'
+            _, (low, high), default = IMAGE_FORMATS[ext]
+            label = "PNG compression level (higher is smaller, slower):" if ext == 'png' else "JPEG quality (higher is larger, sharper):"
+            level, ok = QInputDialog.getInt(self, "Image Compression", label, default, low, high)
+            if not ok:
+                return
             dir_path = QFileDialog.getExistingDirectory(self, "Select Directory for Images")
             if dir_path:
-                for i, viz in enumerate(self.processed_viz):
-                    cv2.imwrite(os.path.join(dir_path, f"frame_{i:04d}.png"), viz)
-                QMessageBox.information(self, "Success", "Image sequence saved")
+                self.start_export(self.result_store.directory, ImageSink(dir_path, ext, level), "Image sequence saved")
         elif export_type == "Numpy Array":
             path, _ = QFileDialog.getSaveFileName(self, "Save Numpy Array", "", "Numpy (*.npy)")
             if path:
                 if not path.endswith('.npy'):
                     path += '.npy'
-                np.save(path, np.stack(self.processed_viz, axis=0))
-                QMessageBox.information(self, "Success", "Numpy array saved")
+                self.start_export(self.result_store.directory, NpyWriter(path), "Numpy array saved")
+        elif export_type == "Raw Flow (NumPy)":
+            raw = self.flow_cache.lookup(self.video_path, self.last_params) if self.flow_cache else None
+            if raw is None:
+                QMessageBox.warning(self, "Error", "Raw results are only kept when 'Cache Raw Results' is enabled")
+                return
+            raw.close()
+            path, _ = QFileDialog.getSaveFileName(self, "Save Raw Flow", "", "Numpy (*.npy)")
+            if path:
+                if not path.endswith('.npy'):
+                    path += '.npy'
+                self.start_export(raw.directory, NpyWriter(path), "Raw flow saved")
+        elif export_type == "Flow Statistics (CSV)":
+            if self.last_statistics is None or not self.last_statistics.rows:
+                QMessageBox.warning(self, "Error", "Flow statistics are collected by optical flow runs (not FlowTrace)")
+                return
+            path, _ = QFileDialog.getSaveFileName(self, "Save Flow Statistics", "", "CSV (*.csv)")
+            if path:
+                if not path.lower().endswith('.csv'):
+                    path += '.csv'
+                self.last_statistics.write_csv(path, output_frames(self.last_params))
+                QMessageBox.information(self, "Success", "Flow statistics saved")
+        elif export_type == "Profiling Report":
+            path, _ = QFileDialog.getSaveFileName(self, "Save Profiling Report", "", "JSON (*.json);;CSV (*.csv)")
+            if path:
+                if not path.lower().endswith(('.json', '.csv')):
+                    path += '.json'
+                write_report(self.last_report, path)
+                QMessageBox.information(self, "Success", "Profiling report saved")
+
+    def start_export(self, directory, sink, message):
+        from src.worker import ExportThread
+        self.export_thread = ExportThread(directory, sink)
+        self.export_thread.progress.connect(self.progress_bar.setValue)
+        self.export_thread.finished.connect(lambda: self.export_finished(message))
+        self.export_thread.cancelled.connect(self.export_cancelled)
+        self.export_thread.error.connect(self.export_failed)
+        self.export_interrupted = False
+        self.export_thread.start()
+        self.export_button.setEnabled(False)
+        self.process_button.setEnabled(False)
+        self.browse_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.status_bar.showMessage("Exporting...")
+
+    def stop_export(self):
+        if self.export_thread and self.export_thread.isRunning():
+            self.export_thread.cancel()
+            self.export_thread.wait()
+
+    def export_finished(self, message):
+        self.export_button.setEnabled(True)
+        self.process_button.setEnabled(True)
+        self.browse_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        if not self.export_interrupted:
+            self.status_bar.showMessage(message)
+            QMessageBox.information(self, "Success", message)
+
+    def export_cancelled(self):
+        self.export_interrupted = True
+        self.status_bar.showMessage("Export cancelled")
+
+    def export_failed(self, msg):
+        self.export_interrupted = True
+        QMessageBox.warning(self, "Error", msg)
+        self.status_bar.showMessage("Export failed")
 
     def display_image(self, img, label):
+        from src.utils import preview_image
         if img is not None:
-            height, width = img.shape[:2]
-            if len(img.shape) == 3:
-                img_display = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                bytes_per_line = 3 * width
-                format = QImage.Format_RGB888
-            else:
-                img_display = img
-                bytes_per_line = width
-                format = QImage.Format_Grayscale8
-            qimg = QImage(img_display.data, width, height, bytes_per_line, format)
-            label.setPixmap(QPixmap.fromImage(qimg).scaled(label.size(), Qt.KeepAspectRatio))
\ No newline at end of file
+            self.display_preview(preview_image(img, (label.width(), label.height())), label)
+
+    def display_preview(self, img, label):
+        # Shows an RGB or grayscale image already fitted by preview_image; only
+        # images smaller than the label still get scaled here.
+        height, width = img.shape[:2]
+        format = QImage.Format_RGB888 if img.ndim == 3 else QImage.Format_Grayscale8
+        pixmap = QPixmap.fromImage(QImage(img.data, width, height, img.strides[0], format))
+        if width != label.width() and height != label.height():
+            pixmap = pixmap.scaled(label.size(), Qt.KeepAspectRatio)
+        label.setPixmap(pixmap)
\ No newline at end of file
@@ -1,41 +1,193 @@
+import shutil
+import subprocess
+import sys
+import threading
 import cv2
 import numpy as np
-import matplotlib.cm as cm
 
-def get_video_metadata(path):
-    cap = cv2.VideoCapture(path, cv2.CAP_MSMF)
+def video_backend():
+    # Capture API tried first for the GUI's probe and playback: Media Foundation
+    # on Windows, AVFoundation on macOS and FFmpeg elsewhere.
+    if sys.platform == 'win32':
+        return cv2.CAP_MSMF
+    if sys.platform == 'darwin':
+        return cv2.CAP_AVFOUNDATION
+    return cv2.CAP_FFMPEG
+
+def open_capture(path):
+    # Falls back to OpenCV's own choice when the platform backend is missing
+    # from this build or cannot read the file.
+    cap = cv2.VideoCapture(path, video_backend())
     if not cap.isOpened():
-        raise ValueError("Could not open video file")
-    metadata = {
+        cap = cv2.VideoCapture(path)
+    return cap
+
+def capture_metadata(cap):
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    return {
         'resolution': (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))),
-        'fps': cap.get(cv2.CAP_PROP_FPS),
-        'duration': cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS) if cap.get(cv2.CAP_PROP_FPS) > 0 else 0,
+        'fps': fps,
+        'frame_count': frame_count,
+        'duration': frame_count / fps if fps > 0 else 0,
         'codec': ''.join([chr((int(cap.get(cv2.CAP_PROP_FOURCC)) >> 8 * i) & 0xFF) for i in range(4)])
     }
+
+def get_video_metadata(path):
+    cap = open_capture(path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video file")
+    metadata = capture_metadata(cap)
     cap.release()
     return metadata
 
+def parse_packet_table(output):
+    # ffprobe csv rows of "pts,dts,flags" in decode order -> frame count and the
+    # display indices of keyframes. Packets are sorted by pts (dts when pts is
+    # missing) so B-frame reordering does not shift the keyframe positions.
+    packets = []
+    for line in output.splitlines():
+        fields = line.strip().split(',')
+        if len(fields) < 3:
+            continue
+        stamp = fields[0] if fields[0] not in ('', 'N/A') else fields[1]
+        if stamp in ('', 'N/A'):
+            continue
+        packets.append((int(stamp), 'K' in fields[2]))
+    packets.sort(key=lambda packet: packet[0])
+    return {
+        'frame_count': len(packets),
+        'keyframes': [i for i, (_, key) in enumerate(packets) if key]
+    }
+
+def build_frame_index(path):
+    # Accurate frame count and keyframe positions, read from the container's
+    # packet table with ffprobe (no decoding). Without ffprobe, falls back to the
+    # frame count OpenCV reports and unknown keyframes.
+    ffprobe = shutil.which('ffprobe')
+    if ffprobe:
+        try:
+            result = subprocess.run(
+                [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                 '-show_entries', 'packet=pts,dts,flags', '-of', 'csv=p=0', path],
+                capture_output=True, text=True, check=True
+            )
+            index = parse_packet_table(result.stdout)
+            if index['frame_count'] > 0:
+                return index
+        except (OSError, subprocess.SubprocessError, ValueError):
+            pass
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError("Could not open video file")
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return {'frame_count': frame_count, 'keyframes': None}
+
+class FlowVisualizer:
+    # Keeps the per-frame scratch buffers for visualize_flow; one instance per thread.
+    def __init__(self):
+        self.shape = None
+
+    def _allocate(self, shape):
+        h, w = shape
+        self.shape = shape
+        self.mag = np.empty((h, w), dtype=np.float32)
+        self.ang = np.empty((h, w), dtype=np.float32)
+        self.scaled = np.empty((h, w), dtype=np.float32)
+        self.hue = np.empty((h, w), dtype=np.uint8)
+        self.saturation = np.full((h, w), 255, dtype=np.uint8)
+        self.value = np.empty((h, w), dtype=np.uint8)
+        self.keep = np.empty((h, w), dtype=np.uint8)
+        self.hsv = np.empty((h, w, 3), dtype=np.uint8)
+
+    def render(self, flow, params):
+        if self.shape != flow.shape[:2]:
+            self._allocate(flow.shape[:2])
+        mag, ang, scaled = self.mag, self.ang, self.scaled
+        cv2.cartToPolar(flow[..., 0], flow[..., 1], magnitude=mag, angle=ang)
+        # Same float32 operation order and truncating casts as allocating the hsv
+        # array per frame, so the encoded bytes are unchanged.
+        np.multiply(ang, 180, out=scaled)
+        np.divide(scaled, np.pi, out=scaled)
+        np.divide(scaled, 2, out=scaled)
+        np.copyto(self.hue, scaled, casting='unsafe')
+        mag_range = params.get('mag_range')
+        if mag_range is None:
+            cv2.normalize(mag, scaled, 0, 255, cv2.NORM_MINMAX)
+        else:
+            # One scale for the whole run (see FlowStatistics.magnitude_range), so
+            # equal speeds look equally bright in every frame.
+            low, high = mag_range
+            np.subtract(mag, low, out=scaled)
+            np.multiply(scaled, 255.0 / (high - low), out=scaled)
+            np.clip(scaled, 0, 255, out=scaled)
+        np.copyto(self.value, scaled, casting='unsafe')
+        # Apply threshold: zero value converts to black, same as masking the BGR output.
+        cv2.compare(mag, params['mag_threshold'], cv2.CMP_GE, dst=self.keep)
+        cv2.bitwise_and(self.value, self.keep, dst=self.value)
+        cv2.merge([self.hue, self.saturation, self.value], dst=self.hsv)
+        rgb = cv2.cvtColor(self.hsv, cv2.COLOR_HSV2BGR)
+        self._draw_arrows(rgb, flow, params)
+        if params['smooth']:
+            rgb = cv2.GaussianBlur(rgb, (5, 5), 0)
+        return rgb
+
+    def _draw_arrows(self, rgb, flow, params):
+        # Grid-sampled arrows drawn in one polylines call. Every arrow has the same
+        # color, so drawing order does not matter and the result matches drawing
+        # each with cv2.arrowedLine (shaft plus two tips at +-45 degrees, tipLength 0.1).
+        step = params['arrow_density']
+        ys, xs = np.nonzero(self.mag[::step, ::step] > params['mag_threshold'])
+        if ys.size == 0:
+            return
+        ys *= step
+        xs *= step
+        fx, fy = flow[ys, xs, 0], flow[ys, xs, 1]
+        ex = np.trunc(xs.astype(np.float32) + fx).astype(np.int32)
+        ey = np.trunc(ys.astype(np.float32) + fy).astype(np.int32)
+        dx, dy = xs - ex, ys - ey
+        tip = np.sqrt(dx * dx + dy * dy) * 0.1
+        angle = np.arctan2(dy, dx)
+        segments = np.empty((3, ys.size, 2, 2), dtype=np.int32)
+        segments[:, :, 1, 0] = ex
+        segments[:, :, 1, 1] = ey
+        segments[0, :, 0, 0] = xs
+        segments[0, :, 0, 1] = ys
+        for i, offset in ((1, np.pi / 4), (2, -np.pi / 4)):
+            segments[i, :, 0, 0] = np.rint(ex + tip * np.cos(angle + offset))
+            segments[i, :, 0, 1] = np.rint(ey + tip * np.sin(angle + offset))
+        segments = segments.reshape(-1, 2, 2)
+        # Short arrows have tips that round onto the shaft end, which the shaft
+        # already covers; skipping them cuts most of the rasterization work.
+        keep = np.any(segments[:, 0] != segments[:, 1], axis=1)
+        keep[:ys.size] = True
+        cv2.polylines(rgb, segments[keep], False, (0, 255, 0), params['arrow_size'])
+
+def preview_image(img, size):
+    # Fits an image into size = (width, height) for display, keeping the aspect
+    # ratio, and converts BGR to RGB. Only ever downscales (INTER_AREA), so small
+    # videos come back at their own size.
+    h, w = img.shape[:2]
+    max_w, max_h = size
+    if w > max_w or h > max_h:
+        if max_w * h <= max_h * w:
+            target = (max_w, max(1, round(h * max_w / w)))
+        else:
+            target = (max(1, round(w * max_h / h)), max_h)
+        img = cv2.resize(img, target, interpolation=cv2.INTER_AREA)
+    if img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(img)
+
+_visualizers = threading.local()
+
 def visualize_flow(flow, shape, params):
-    # Stub: Implement full visualization
-    # Example: Color-coded magnitude and angle
-    mag, ang = cv2.cartToPolar(flow[..., 0], flow[..., 1])
-    hsv = np.zeros((shape[0], shape[1], 3), dtype=np.uint8)
-    hsv[..., 0] = ang * 180 / np.pi / 2
-    hsv[..., 1] = 255
-    hsv[..., 2] = cv2.normalize(mag, None, 0, 255, cv2.NORM_MINMAX)
-    rgb = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-    # Apply threshold
-    rgb[mag < params['mag_threshold']] = 0
-    # Add arrows (simplified)
-    step = params['arrow_density']
-    for y in range(0, flow.shape[0], step):
-        for x in range(0, flow.shape[1], step):
-            fx, fy = flow[y, x]
-            if mag[y, x] > params['mag_threshold']:
-                cv2.arrowedLine(rgb, (x, y), (int(x + fx), int(y + fy)), (0, 255, 0), params['arrow_size'])
-    if params['smooth']:
-        rgb = cv2.GaussianBlur(rgb, (5, 5), 0)
-    return rgb
+    # Color-coded angle (hue) and magnitude (value) with grid-sampled arrows.
+    visualizer = getattr(_visualizers, 'flow', None)
+    if visualizer is None:
+        visualizer = _visualizers.flow = FlowVisualizer()
+    return visualizer.render(flow, params)
 
 def visualize_flowtrace(trace, original_shape, params):
     # Convert grayscale trace to RGB for display.
@@ -1,11 +1,22 @@
 from PySide6.QtCore import Qt, QTimer, Signal, QThread
+import threading
+import time
 import cv2
 import numpy as np
-from src.processors import compute_flow, compute_flowtrace
-from src.utils import visualize_flow, visualize_flowtrace
+from src.pipeline import (
+    Cancelled, FrameReader, build_thumbnails, check_cancel, iter_results, output_count, render_outputs, validate_params
+)
+from src.profiling import Profiler
+from src.stats import FlowStatistics
+from src.storage import FrameStore
+from src.utils import build_frame_index, capture_metadata, open_capture, preview_image
 
 class VideoLoaderThread(QThread):
-    metadata_ready = Signal(dict)
+    # Probes a video and opens its playback capture off the GUI thread, which
+    # can take a while for large files, network paths or slow demuxers. Emits
+    # loaded(metadata, capture, first frame or None); the receiver owns the
+    # capture, positioned after the first frame.
+    loaded = Signal(dict, object, object)
     error = Signal(str)
 
     def __init__(self, video_path):
@@ -14,79 +25,317 @@ class VideoLoaderThread(QThread):
 
     def run(self):
         try:
-            cap = cv2.VideoCapture(self.video_path)
+            cap = open_capture(self.video_path)
             if not cap.isOpened():
-                raise ValueError("Could not open video")
-            metadata = {
-                'resolution': (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))),
-                'fps': cap.get(cv2.CAP_PROP_FPS),
-                'duration': cap.get(cv2.CAP_PROP_FRAME_COUNT) / cap.get(cv2.CAP_PROP_FPS),
-                'codec': cap.get(cv2.CAP_PROP_FOURCC)
-            }
-            cap.release()
-            self.metadata_ready.emit(metadata)
+                raise ValueError("Could not open video file")
+            metadata = capture_metadata(cap)
+            ret, frame = cap.read()
+            self.loaded.emit(metadata, cap, frame if ret else None)
+        except Exception as e:
+            self.error.emit(str(e))
+
+class FrameIndexThread(QThread):
+    index_ready = Signal(dict)
+    error = Signal(str)
+
+    def __init__(self, video_path):
+        super().__init__()
+        self.video_path = video_path
+
+    def run(self):
+        try:
+            self.index_ready.emit(build_frame_index(self.video_path))
         except Exception as e:
             self.error.emit(str(e))
 
+class ThumbnailThread(QThread):
+    # Fills `thumbnails` (a ThumbnailIndex) in the background; readers can use it
+    # while it grows.
+    error = Signal(str)
+
+    def __init__(self, video_path, thumbnails, frame_count, frame_index=None, size=(160, 120)):
+        super().__init__()
+        self.video_path = video_path
+        self.thumbnails = thumbnails
+        self.frame_count = frame_count
+        self.frame_index = frame_index
+        self.size = size
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        cap = cv2.VideoCapture(self.video_path)
+        try:
+            build_thumbnails(cap, self.frame_count, self.thumbnails, self.size, self.frame_index, cancel=self._cancel)
+        except Cancelled:
+            pass
+        except Exception as e:
+            self.error.emit(str(e))
+        finally:
+            cap.release()
+
+class FrameFetcher(QThread):
+    # Decodes exact frames for scrubbing on its own capture. Only the newest
+    # request is served (older ones are dropped while it is busy); decoded frames
+    # go into `cache` and are announced through frame_ready(index, frame).
+    # Sequential requests reuse the reader position instead of seeking. The
+    # keyframe index usually arrives after the fetcher has started and is handed
+    # over with set_frame_index().
+    frame_ready = Signal(int, np.ndarray)
+
+    def __init__(self, video_path, cache, frame_index=None):
+        super().__init__()
+        self.video_path = video_path
+        self.cache = cache
+        self.frame_index = frame_index
+        self._condition = threading.Condition()
+        self._request = None
+        self._stopped = False
+
+    def request(self, index):
+        with self._condition:
+            self._request = index
+            self._condition.notify()
+
+    def set_frame_index(self, frame_index):
+        with self._condition:
+            self.frame_index = frame_index
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        cap = cv2.VideoCapture(self.video_path)
+        reader = FrameReader(cap, self.frame_index)
+        try:
+            while True:
+                with self._condition:
+                    while self._request is None and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+                    index, self._request = self._request, None
+                    # Seeks use the keyframes from the next read on.
+                    reader.keyframes = (self.frame_index or {}).get('keyframes')
+                frame = self.cache.get(index)
+                if frame is None:
+                    ret, frame = reader.read(index)
+                    if not ret:
+                        reader.position = None  # Force a seek next time.
+                        continue
+                    self.cache.put(index, frame)
+                self.frame_ready.emit(index, frame)
+        finally:
+            cap.release()
+
+class PreviewSlot:
+    # Single-entry mailbox between a worker and the GUI thread. put() overwrites
+    # whatever the GUI has not collected yet (newest frame wins) and reports
+    # whether the slot was empty, so at most one notification is ever queued.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item = None
+
+    def put(self, item):
+        with self._lock:
+            was_empty = self._item is None
+            self._item = item
+        return was_empty
+
+    def take(self):
+        with self._lock:
+            item, self._item = self._item, None
+        return item
+
 class FlowProcessorThread(QThread):
+    # Full-resolution results go only to the store. The GUI gets (frame, viz)
+    # previews downscaled to preview_size in this thread, at most preview_fps
+    # times a second, collected from self.preview on preview_ready.
+    # With checkpoints, `store` comes from Checkpoints.open(): the run continues
+    # after the frames it already holds and saves its progress periodically and
+    # when it stops. cancel() stops the run within a frame. Flow statistics of
+    # the outputs produced by this run collect in self.statistics.
+    # With a `sink` (see src.export) every visualization is also encoded while
+    # the run goes on, starting with those a resumed store already holds; the
+    # sink is closed at the end, or aborted if the run does not finish.
     progress = Signal(int)
-    frame_ready = Signal(np.ndarray, np.ndarray)
+    preview_ready = Signal()
+    stats = Signal(str)
+    cancelled = Signal()
     error = Signal(str)
+    STATS_INTERVAL = 0.5  # seconds between live readouts
 
-    def __init__(self, video_path, params):
+    def __init__(self, video_path, params, store=None, cache=None, preview_size=(320, 240), preview_fps=15, checkpoints=None, sink=None):
         super().__init__()
         self.video_path = video_path
         self.params = params
+        self.store = store
+        self.cache = cache
+        self.checkpoints = checkpoints if store is not None else None
+        self.first_output = len(store) if self.checkpoints is not None else 0
+        self.preview_size = preview_size
+        self.preview_interval = 1.0 / preview_fps
+        self.preview = PreviewSlot()
+        self.profiler = Profiler()
+        self.statistics = FlowStatistics(self.first_output)
+        self.sink = sink
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _checkpoint(self, complete=False):
+        if self.checkpoints is not None:
+            with self.profiler.stage('checkpoint'):
+                self.checkpoints.save(self.store, complete)
+
+    def results(self):
+        # (frame, visualization) pairs still to be stored.
+        return iter_results(self.video_path, self.params, self.cache, self.profiler, self._cancel, self.first_output, self.statistics)
+
+    def _send_preview(self, frame, viz):
+        with self.profiler.stage('preview_scale'):
+            item = (preview_image(frame, self.preview_size), preview_image(viz, self.preview_size))
+        if self.preview.put(item):
+            self.preview_ready.emit()
 
     def run(self):
         try:
-            cap = cv2.VideoCapture(self.video_path)
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            start = self.params['start_frame']
-            end = self.params['end_frame']
-            step = self.params['step']
-            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
-            if self.params['algorithm'] == "FlowTrace":
-                trace_length = self.params['win_size']
-                if trace_length > (end - start + 1):
-                    raise ValueError("Trace length exceeds selected frame range")
-                frame_buffer = []
-                processed = 0
-                total_windows = max(0, ((end - start + 1) - trace_length + 1) // step)
-                for i in range(start, end + 1, step):
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    frame_buffer.append(gray)
-                    if len(frame_buffer) > trace_length:
-                        frame_buffer.pop(0)
-                    if len(frame_buffer) == trace_length:
-                        stack = np.stack(frame_buffer, axis=0)
-                        trace = compute_flowtrace(stack, self.params)
-                        trace_viz = visualize_flowtrace(trace, frame.shape, self.params)
-                        self.frame_ready.emit(frame, trace_viz)
-                        processed += 1
-                        if total_windows > 0:
-                            self.progress.emit(int((processed / total_windows) * 100))
-                cap.release()
-            else:
-                prev_gray = None
-                processed = 0
-                total_pairs = max(0, ((end - start) // step))
-                for i in range(start, end + 1, step):
-                    ret, frame = cap.read()
-                    if not ret:
-                        break
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    if prev_gray is not None:
-                        flow = compute_flow(prev_gray, gray, self.params)
-                        flow_viz = visualize_flow(flow, frame.shape, self.params)
-                        self.frame_ready.emit(frame, flow_viz)
-                        processed += 1
-                        if total_pairs > 0:
-                            self.progress.emit(int((processed / total_pairs) * 100))
-                    prev_gray = gray
-                cap.release()
+            validate_params(self.params)
+            total = output_count(self.params)
+            processed = self.first_output
+            percent = -1
+            profiler = self.profiler
+            last_stats = last_preview = -float('inf')
+            last_checkpoint = time.perf_counter()
+            skipped = None
+            if self.sink is not None:
+                for i in range(self.first_output):
+                    check_cancel(self._cancel)
+                    with profiler.stage('encode'):
+                        self.sink.write(self.store[i])
+            results = self.results()
+            try:
+                for frame, viz in results:
+                    check_cancel(self._cancel)
+                    if self.store is not None:
+                        with profiler.stage('store'):
+                            self.store.append(viz)
+                    if self.sink is not None:
+                        with profiler.stage('encode'):
+                            self.sink.write(viz)
+                    profiler.tick()
+                    processed += 1
+                    now = time.perf_counter()
+                    if frame is None:
+                        pass  # Parallel runs only keep some source frames; the next one is previewed.
+                    elif now - last_preview >= self.preview_interval:
+                        self._send_preview(frame, viz)
+                        last_preview = now
+                        skipped = None
+                    else:
+                        skipped = (frame, viz)
+                    if total > 0 and int((processed / total) * 100) != percent:
+                        percent = int((processed / total) * 100)
+                        self.progress.emit(percent)
+                    if now - last_stats >= self.STATS_INTERVAL:
+                        self.stats.emit(profiler.summary())
+                        last_stats = now
+                    if self.checkpoints is not None and now - last_checkpoint >= self.checkpoints.interval:
+                        self._checkpoint()
+                        last_checkpoint = now
+            finally:
+                # Releases the capture right away, also when cancelled here.
+                results.close()
+            if skipped is not None:
+                # The last frame is always shown, even if it fell inside the interval.
+                self._send_preview(*skipped)
+            if self.sink is not None:
+                with profiler.stage('encode_flush'):
+                    self.sink.close()
+            self._checkpoint(complete=True)
+        except Cancelled:
+            self._abort_sink()
+            self._checkpoint()
+            self.cancelled.emit()
+        except Exception as e:
+            self._abort_sink()
+            # Frames stored so far are valid, so keep them resumable.
+            try:
+                self._checkpoint()
+            except Exception:
+                pass
+            self.error.emit(str(e))
+
+    def _abort_sink(self):
+        if self.sink is not None:
+            try:
+                self.sink.abort()
+            except Exception:
+                pass
+
+
+class RenderThread(FlowProcessorThread):
+    # Re-renders the cached raw results in `raw_directory` (a FlowCache entry)
+    # with new display parameters into `store`, without decoding or computing
+    # anything. Sends no previews; the GUI renders the visible frame itself.
+    def __init__(self, video_path, params, raw_directory, store, checkpoints=None):
+        super().__init__(video_path, params, store, checkpoints=checkpoints)
+        self.raw_directory = raw_directory
+
+    def results(self):
+        # Its own handle on the entry, so the GUI can keep reading from another one.
+        raw = FrameStore.open(self.raw_directory)
+        try:
+            for viz in render_outputs(self.params, raw, self.profiler, self._cancel, self.first_output):
+                yield None, viz
+        finally:
+            raw.close()
+
+    def _send_preview(self, frame, viz):
+        pass
+
+class ExportThread(QThread):
+    # Writes the frames of the FrameStore in `directory` (a finished result
+    # store or cache entry) to `sink`, on its own handle so the GUI can keep
+    # reading the store. cancel() stops within a frame; a cancelled or failed
+    # export deletes its partial output.
+    progress = Signal(int)
+    cancelled = Signal()
+    error = Signal(str)
+
+    def __init__(self, directory, sink):
+        super().__init__()
+        self.directory = directory
+        self.sink = sink
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def run(self):
+        try:
+            store = FrameStore.open(self.directory)
+            try:
+                total = len(store)
+                percent = -1
+                for i, frame in enumerate(store):
+                    check_cancel(self._cancel)
+                    self.sink.write(frame)
+                    if int((i + 1) * 100 / total) != percent:
+                        percent = int((i + 1) * 100 / total)
+                        self.progress.emit(percent)
+                self.sink.close()
+            finally:
+                store.close()
+        except Cancelled:
+            self.sink.abort()
+            self.cancelled.emit()
         except Exception as e:
+            self.sink.abort()
             self.error.emit(str(e))
\ No newline at end of file
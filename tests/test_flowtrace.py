@@ -0,0 +1,68 @@
+import itertools
+import numpy as np
+import pytest
+from src.processors import compute_flowtrace, FlowTraceEngine
+
+# Run from the repository root: python -m pytest tests
+
+def synthetic_frames(count, height, width, seed=1):
+    # Static textured background with sensor noise and a bright blob sweeping down.
+    rng = np.random.default_rng(seed)
+    base = rng.integers(40, 200, (height, width)).astype(np.int16)
+    frames = np.empty((count, height, width), dtype=np.uint8)
+    for t in range(count):
+        frame = base + rng.integers(-4, 5, (height, width))
+        y = (t * 3) % max(1, height - 20)
+        frame[y:y + 20, width // 4:width // 4 + 40] = 250
+        np.clip(frame, 0, 255, out=frame)
+        frames[t] = frame
+    return frames
+
+def reference_flowtrace(stack, params):
+    # The original float64 formulation every FlowTrace path has to match.
+    if params['invert']:
+        stack = 255 - stack
+    if params['bg_subtract']:
+        bg = np.median(stack, axis=0)
+        stack = stack - bg[None, :, :]
+        stack = np.clip(stack, 0, 255)
+    return np.max(stack, axis=0).astype(np.uint8)
+
+FRAMES = synthetic_frames(48, 24, 32)
+CASES = list(itertools.product([1, 2, 5, 8, 9, 16, 17], [False, True], [False, True]))
+
+def windows(length):
+    for t in range(length - 1, len(FRAMES)):
+        yield t, FRAMES[t - length + 1:t + 1]
+
+@pytest.mark.parametrize('length, invert, bg_subtract', CASES)
+def test_compute_flowtrace_matches_reference(length, invert, bg_subtract):
+    params = {'invert': invert, 'bg_subtract': bg_subtract}
+    for t, window in windows(length):
+        assert np.array_equal(compute_flowtrace(window, params), reference_flowtrace(window, params)), t
+
+# "histogram" and "partition" force the engine's median path whatever the window length.
+@pytest.mark.parametrize('mode', ['histogram', 'partition', 'compact'])
+@pytest.mark.parametrize('length, invert, bg_subtract', CASES)
+def test_engine_matches_reference(monkeypatch, mode, length, invert, bg_subtract):
+    if mode == 'histogram':
+        monkeypatch.setattr(FlowTraceEngine, 'HISTOGRAM_MIN_LENGTH', 1)
+    elif mode == 'partition':
+        monkeypatch.setattr(FlowTraceEngine, 'HISTOGRAM_MAX_BYTES', 0)
+    params = {'win_size': length, 'invert': invert, 'bg_subtract': bg_subtract, 'trace_compact': mode == 'compact'}
+    engine = FlowTraceEngine(FRAMES.shape[1:], params)
+    assert (engine.hist is not None) == (mode == 'histogram' and bg_subtract)
+    for t, frame in enumerate(FRAMES):
+        trace = engine.push(frame)
+        if t < length - 1:
+            assert trace is None
+        else:
+            assert np.array_equal(trace, reference_flowtrace(FRAMES[t - length + 1:t + 1], params)), t
+
+def test_engine_histogram_respects_memory_budget(monkeypatch):
+    params = {'win_size': FlowTraceEngine.HISTOGRAM_MIN_LENGTH, 'invert': False, 'bg_subtract': True}
+    hist_bytes = FRAMES[0].size * 256  # uint8 counts
+    monkeypatch.setattr(FlowTraceEngine, 'HISTOGRAM_MAX_BYTES', hist_bytes)
+    assert FlowTraceEngine(FRAMES.shape[1:], params).hist is not None
+    monkeypatch.setattr(FlowTraceEngine, 'HISTOGRAM_MAX_BYTES', hist_bytes - 1)
+    assert FlowTraceEngine(FRAMES.shape[1:], params).hist is None
\ No newline at end of file